@@ -0,0 +1,130 @@
+"""Benchmark the active-services query before and after the remaining column.
+
+Seeds a scratch MySQL/MariaDB database with a service table, then measures
+the original query (dict cursor + fetchall) and the sargable query
+(indexed remaining column + streamed cursor). Each measurement runs in its
+own process so peak RSS is not shared between them.
+
+    python bench/active_query.py --host 127.0.0.1 --user root --password secret
+
+The --database given here is dropped and recreated.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from eligibility import EligibilityRules  # noqa: E402
+from seed_xmplus import (GIB, add_database_arguments, connect, insert_services,  # noqa: E402
+                         migrate, recreate)
+from xmplus_db import fetch_active_uuids  # noqa: E402
+
+RULES = EligibilityRules()
+LEGACY_ACTIVE_QUERY, LEGACY_PARAMS = RULES.compile(use_remaining_column=False)
+SARGABLE_ACTIVE_QUERY, SARGABLE_PARAMS = RULES.compile(use_remaining_column=True)
+
+
+def seed(args) -> None:
+    rng = random.Random(args.seed)
+
+    def rows():
+        for _ in range(args.rows):
+            traffic = rng.choice((10, 30, 50, 100)) * GIB
+            yield (str(uuid.UUID(int=rng.getrandbits(128))),
+                   1 if rng.random() < args.active_ratio else 0,
+                   traffic, int(traffic * rng.random() ** 0.5))
+
+    recreate(args)
+    insert_services(args, rows())
+
+
+def explain(args, query: str, params: list) -> list:
+    conn = connect(args)
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("EXPLAIN " + query, params)
+    plan = [{k: row.get(k) for k in ('type', 'key', 'rows', 'Extra')} for row in cursor.fetchall()]
+    conn.close()
+    return plan
+
+
+def measure(args) -> None:
+    """Child process: run one variant args.repeat times and print a JSON result"""
+    conn = connect(args)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    count = 0
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        if args.measure == 'before':
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(LEGACY_ACTIVE_QUERY, LEGACY_PARAMS)
+            active = {row['uuid'] for row in cursor.fetchall()}
+            cursor.close()
+        else:
+            active = fetch_active_uuids(conn, RULES)
+        timings.append(time.perf_counter() - started)
+        count = len(active)
+        del active
+    conn.close()
+    print(json.dumps({
+        'active': count,
+        'median_seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'rss_growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb
+    }))
+
+
+def run_child(args, variant: str) -> dict:
+    command = [sys.executable, os.path.abspath(__file__), '--measure', variant,
+               '--host', args.host, '--port', str(args.port), '--user', args.user,
+               '--password', args.password, '--database', args.database,
+               '--repeat', str(args.repeat)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--active-ratio', type=float, default=0.7)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--measure', choices=('before', 'after'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args)
+        return
+
+    print(f"Seeding {args.rows} services into {args.database}...")
+    seed(args)
+    before_plan = explain(args, LEGACY_ACTIVE_QUERY, LEGACY_PARAMS)
+    before = run_child(args, 'before')
+
+    print("Adding the remaining column and index...")
+    migrate(args)
+    after_plan = explain(args, SARGABLE_ACTIVE_QUERY, SARGABLE_PARAMS)
+    after = run_child(args, 'after')
+
+    for label, plan, result in (('before', before_plan, before), ('after', after_plan, after)):
+        print(f"\n{label}: {result['active']} active services")
+        print(f"  plan:        {plan}")
+        print(f"  median time: {result['median_seconds'] * 1000:.1f} ms "
+              f"(min {result['min_seconds'] * 1000:.1f} ms)")
+        print(f"  peak RSS:    {result['peak_rss_kb'] / 1024:.1f} MiB "
+              f"(+{result['rss_growth_kb'] / 1024:.1f} MiB while querying)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Local stand-in for the s-ui apiv2 endpoints the sync uses.
+
+Serves GET /clients, GET /client/<id>, GET /inbounds and POST /save (new,
+edit and del) from memory, with an optional delay per request, and counts
+every call. Clients have the same fields and config size as the
+ones the sync creates.
+
+    python bench/mock_sui.py --port 2095 --clients 10000 --traffic-ratio 0.5 --latency-ms 5
+
+Point sui_api.base_url at http://127.0.0.1:2095/app/apiv2 to sync against it.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from seed_xmplus import service_uuids
+
+API_PREFIX = '/app/apiv2'
+CLIENT_PATH = re.compile(r'^/client/(\d+)$')
+
+
+def client_record(client_id: int, name: str, up: int = 0, down: int = 0) -> Dict:
+    """A client shaped like the ones ClientTemplate builds, with fixed credentials"""
+    secret = name.replace('-', '')
+    return {
+        "id": client_id,
+        "enable": True,
+        "name": name,
+        "config": {
+            "mixed": {"username": name, "password": name},
+            "socks": {"username": name, "password": name},
+            "http": {"username": name, "password": name},
+            "shadowsocks": {"name": name, "password": secret + '00000000000='},
+            "shadowsocks16": {"name": name, "password": secret[:22] + '=='},
+            "shadowtls": {"name": name, "password": secret + '00000000000='},
+            "vmess": {"name": name, "uuid": name, "alterId": 0},
+            "vless": {"name": name, "uuid": name, "flow": "xtls-rprx-vision"},
+            "trojan": {"name": name, "password": name},
+            "naive": {"username": name, "password": name},
+            "hysteria": {"name": name, "auth_str": name},
+            "tuic": {"name": name, "uuid": name, "password": name},
+            "hysteria2": {"name": name, "password": name}
+        },
+        "inbounds": [1],
+        "links": [{
+            "remark": "hysteria2-443",
+            "type": "local",
+            "uri": f"hysteria2://{name}@127.0.0.1:443?fastopen=0&obfs=salamander&obfs-password=bench#{name}"
+        }],
+        "volume": 0,
+        "expiry": 0,
+        "up": up,
+        "down": down,
+        "desc": "",
+        "group": ""
+    }
+
+
+class MockSUI:
+    """In-memory s-ui panel served over HTTP from a background thread"""
+
+    def __init__(self, latency: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.clients: Dict[int, Dict] = {}
+        self.inbounds = [{"id": 1, "type": "hysteria2", "tag": "hysteria2-443", "listen_port": 443}]
+        self.calls: Dict[str, int] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+        # /clients is served many times between changes, so keep the encoded body
+        self._clients_body: Optional[bytes] = None
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def start(self) -> 'MockSUI':
+        threading.Thread(target=self._server.serve_forever, name='mock-sui', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def load(self, clients: Iterable[Tuple[str, int, int]]) -> None:
+        """Replace all clients with (name, up, down) entries and clear the call counts"""
+        with self._lock:
+            self.clients = {}
+            self._next_id = 1
+            for name, up, down in clients:
+                self._add(client_record(self._next_id, name, up, down))
+            self.calls = {}
+            self._clients_body = None
+
+    def call_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.calls)
+
+    def _add(self, data: Dict) -> None:
+        data = dict(data, id=self._next_id)
+        self.clients[self._next_id] = data
+        self._next_id += 1
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        self.calls[key] = self.calls.get(key, 0) + amount
+
+    def clients_body(self) -> bytes:
+        with self._lock:
+            self._count('GET clients')
+            if self._clients_body is None:
+                self._clients_body = json.dumps(
+                    {"success": True, "msg": "", "obj": {"clients": list(self.clients.values())}}).encode()
+            return self._clients_body
+
+    def inbound_list(self) -> List[Dict]:
+        with self._lock:
+            self._count('GET inbounds')
+            return list(self.inbounds)
+
+    def client(self, client_id: int) -> Optional[Dict]:
+        with self._lock:
+            self._count('GET client')
+            return self.clients.get(client_id)
+
+    def save(self, obj: str, action: str, data) -> Tuple[bool, str]:
+        items = data if isinstance(data, list) else [data]
+        with self._lock:
+            self._count(f"POST save {action}")
+            self._count(f"items {action}", len(items))
+            if obj != 'clients':
+                return False, f"unsupported object {obj}"
+            if action == 'new':
+                for item in items:
+                    self._add(item)
+            elif action == 'edit':
+                for item in items:
+                    if item.get('id') not in self.clients:
+                        return False, f"client {item.get('id')} not found"
+                    self.clients[item['id']] = item
+            elif action == 'del':
+                for client_id in items:
+                    self.clients.pop(int(client_id), None)
+            else:
+                return False, f"unsupported action {action}"
+            self._clients_body = None
+        return True, ""
+
+
+def _make_handler(mock: MockSUI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out as separate writes; without this keep-alive requests stall on delayed ACKs
+        disable_nagle_algorithm = True
+
+        def _send(self, body: bytes, status: int = 200) -> None:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, obj: Dict, status: int = 200) -> None:
+            self._send(json.dumps(obj).encode(), status)
+
+        def _path(self) -> Optional[str]:
+            path = self.path.split('?')[0]
+            if not path.startswith(API_PREFIX + '/'):
+                return None
+            return path[len(API_PREFIX):]
+
+        def _form(self) -> Dict[str, str]:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            header = f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode()
+            message = BytesParser(policy=policy.default).parsebytes(header + body)
+            if not message.is_multipart():
+                return {}
+            return {part.get_param('name', header='content-disposition'): part.get_content()
+                    for part in message.iter_parts()}
+
+        def do_GET(self):
+            if mock.latency:
+                time.sleep(mock.latency)
+            path = self._path()
+            if path == '/clients':
+                self._send(mock.clients_body())
+                return
+            if path == '/inbounds':
+                self._send_json({"success": True, "msg": "", "obj": {"inbounds": mock.inbound_list()}})
+                return
+            match = CLIENT_PATH.match(path or '')
+            if match:
+                client = mock.client(int(match.group(1)))
+                self._send_json({"success": client is not None,
+                                 "msg": "" if client is not None else "not found", "obj": client})
+                return
+            self._send_json({"success": False, "msg": "not found"}, 404)
+
+        def do_POST(self):
+            if mock.latency:
+                time.sleep(mock.latency)
+            if self._path() != '/save':
+                self._send_json({"success": False, "msg": "not found"}, 404)
+                return
+            form = self._form()
+            try:
+                data = json.loads(form.get('data', 'null'))
+            except json.JSONDecodeError as e:
+                self._send_json({"success": False, "msg": f"bad data: {e}"})
+                return
+            success, msg = mock.save(form.get('object', ''), form.get('action', ''), data)
+            self._send_json({"success": success, "msg": msg, "obj": None})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def bench_clients(names: Iterable[str], traffic_ratio: float, seed: int) -> Iterable[Tuple[str, int, int]]:
+    """(name, up, down) with traffic on about traffic_ratio of the clients"""
+    rng = random.Random(seed)
+    for name in names:
+        if rng.random() < traffic_ratio:
+            yield name, rng.randint(1, 2 * 1024 ** 3), rng.randint(1, 8 * 1024 ** 3)
+        else:
+            yield name, 0, 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2095)
+    parser.add_argument('--clients', type=int, default=0,
+                        help="clients to start with, named like bench/seed_xmplus.py services")
+    parser.add_argument('--traffic-ratio', type=float, default=0.0)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    mock = MockSUI(latency=args.latency_ms / 1000, host=args.host, port=args.port)
+    mock.load(bench_clients(service_uuids(args.clients, args.seed), args.traffic_ratio, args.seed))
+    mock.start()
+    print(f"Serving {args.clients} clients on {mock.base_url}, Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    mock.stop()
+    print(json.dumps(mock.call_counts(), indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
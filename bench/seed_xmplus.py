@@ -0,0 +1,129 @@
+"""Create and fill a scratch XMPlus service table for the benchmarks.
+
+Service uuids come from a seeded generator, so the mock s-ui panel in
+bench/mock_sui.py can be filled with the same names.
+
+    python bench/seed_xmplus.py --host 127.0.0.1 --user root --password secret --services 10000
+
+The --database given here is dropped and recreated.
+"""
+import argparse
+import os
+import random
+import uuid
+from typing import Iterable, List, Tuple
+
+import mysql.connector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GIB = 1024 ** 3
+INSERT_BATCH = 5000
+
+SCHEMA = """
+    CREATE TABLE service (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        uuid VARCHAR(64) NOT NULL,
+        status TINYINT NOT NULL,
+        traffic BIGINT UNSIGNED NOT NULL,
+        total_used BIGINT UNSIGNED NOT NULL,
+        u BIGINT UNSIGNED NOT NULL DEFAULT 0,
+        d BIGINT UNSIGNED NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        INDEX idx_service_uuid (uuid)
+    )
+"""
+
+# (uuid, status, traffic, total_used)
+ServiceRow = Tuple[str, int, int, int]
+
+
+def add_database_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--database', default='xmplus_bench')
+
+
+def connect(args, database=True):
+    params = {'host': args.host, 'port': args.port, 'user': args.user, 'password': args.password}
+    if database:
+        params['database'] = args.database
+    return mysql.connector.connect(**params)
+
+
+def service_uuids(count: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(count)]
+
+
+def active_row(token: str, rng: random.Random) -> ServiceRow:
+    """A service with status 1 and far more than rules.min_remaining left"""
+    traffic = rng.choice((50, 100, 200)) * GIB
+    return token, 1, traffic, int(traffic * rng.random() * 0.5)
+
+
+def recreate(args) -> None:
+    conn = connect(args, database=False)
+    cursor = conn.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS `{args.database}`")
+    cursor.execute(f"CREATE DATABASE `{args.database}`")
+    cursor.execute(f"USE `{args.database}`")
+    cursor.execute(SCHEMA)
+    conn.close()
+
+
+def insert_services(args, rows: Iterable[ServiceRow]) -> None:
+    conn = connect(args)
+    cursor = conn.cursor()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH:
+            cursor.executemany(
+                "INSERT INTO service (uuid, status, traffic, total_used) VALUES (%s, %s, %s, %s)", batch)
+            batch = []
+    if batch:
+        cursor.executemany(
+            "INSERT INTO service (uuid, status, traffic, total_used) VALUES (%s, %s, %s, %s)", batch)
+    conn.commit()
+    conn.close()
+
+
+def migrate(args) -> None:
+    """Apply sql/service_remaining.sql"""
+    with open(os.path.join(ROOT, 'sql', 'service_remaining.sql')) as f:
+        statement = '\n'.join(line for line in f if not line.lstrip().startswith('--'))
+    conn = connect(args)
+    cursor = conn.cursor()
+    cursor.execute(statement)
+    cursor.execute("ANALYZE TABLE service")
+    cursor.fetchall()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument('--services', type=int, default=10000)
+    parser.add_argument('--active-ratio', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--migrate', action='store_true',
+                        help="also add the remaining column and index from sql/service_remaining.sql")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rows = []
+    for token in service_uuids(args.services, args.seed):
+        token, _, traffic, used = active_row(token, rng)
+        rows.append((token, 1 if rng.random() < args.active_ratio else 0, traffic, used))
+
+    recreate(args)
+    insert_services(args, rows)
+    if args.migrate:
+        migrate(args)
+    print(f"Seeded {len(rows)} services into {args.database}")
+
+
+if __name__ == "__main__":
+    main()
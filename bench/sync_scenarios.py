@@ -0,0 +1,203 @@
+"""Benchmark sync_users, sync_traffic and full_sync against a mock s-ui panel.
+
+Each scenario seeds a scratch MySQL/MariaDB service table (bench/seed_xmplus.py)
+and an in-process mock s-ui (bench/mock_sui.py), then runs each operation in
+its own process with a fresh state file:
+
+    cold_start  every service is active, s-ui has no clients yet
+    churn       s-ui is in sync, then --churn of the services expire and as many new ones appear
+    traffic     s-ui is in sync and --traffic-ratio of the clients have used traffic
+
+Reported per run: wall time of the operation, s-ui calls by endpoint and
+action, DB statements (the server's Questions counter, so use a server
+nothing else talks to) and pool checkouts, and peak RSS.
+
+    python bench/sync_scenarios.py --host 127.0.0.1 --user root --password secret --users 10000
+
+The --database given here is dropped and recreated for every run.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from mock_sui import MockSUI, bench_clients  # noqa: E402
+from seed_xmplus import (ServiceRow, active_row, add_database_arguments, connect,  # noqa: E402
+                         insert_services, migrate, recreate, service_uuids)
+
+SCENARIOS = ('cold_start', 'churn', 'traffic')
+OPERATIONS = ('sync_users', 'sync_traffic', 'full_sync')
+
+
+def build_scenario(name: str, args) -> Tuple[List[ServiceRow], List[Tuple[str, int, int]]]:
+    """Service rows and (name, up, down) s-ui clients for one scenario"""
+    rng = random.Random(args.seed)
+    churned = int(args.users * args.churn)
+    uuids = service_uuids(args.users + churned, args.seed)
+    current = uuids[:args.users]
+
+    if name == 'cold_start':
+        return [active_row(token, rng) for token in current], []
+
+    if name == 'churn':
+        rows = [active_row(token, rng) for token in uuids]
+        # The first services ran out, the extra ones are new since the last sync
+        for i in range(churned):
+            token, _, traffic, _ = rows[i]
+            rows[i] = (token, 0, traffic, traffic)
+        return rows, [(token, 0, 0) for token in current]
+
+    rows = [active_row(token, rng) for token in current]
+    return rows, list(bench_clients(current, args.traffic_ratio, args.seed))
+
+
+def child_config(args, base_url: str, state_dir: str) -> Dict:
+    return {
+        "database": {"xmplus": {"host": args.host, "port": args.port, "user": args.user,
+                                "password": args.password, "database": args.database}},
+        "obfs_password": "bench",
+        "sync": {
+            "lock_path": os.path.join(state_dir, 'sync.lock'),
+            "traffic_mode": args.traffic_mode,
+            "state_path": os.path.join(state_dir, 'sync_state.db'),
+            "batch_size": args.batch_size,
+            "concurrency": args.concurrency
+        },
+        "sui_api": {"base_url": base_url, "retries": 0},
+        "logging": {"level": "WARNING", "dir": state_dir, "console": False},
+        "sui_read_backend": "api",
+        "server_ip": "127.0.0.1",
+        "api_token": "bench"
+    }
+
+
+def measure(args) -> None:
+    """Child process: run one operation once and print a JSON result"""
+    from sync_service import SyncService, load_config
+
+    service = SyncService(load_config(args.config))
+    checkouts = 0
+    connection = service.db_pool.connection
+
+    def counted_connection():
+        nonlocal checkouts
+        checkouts += 1
+        return connection()
+
+    service.db_pool.connection = counted_connection
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    result = getattr(service, args.measure)()
+    elapsed = time.perf_counter() - started
+    service.close()
+    print(json.dumps({
+        'seconds': elapsed,
+        'result': result,
+        'db_checkouts': checkouts,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'rss_growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb
+    }))
+
+
+def questions(args) -> int:
+    conn = connect(args)
+    cursor = conn.cursor()
+    cursor.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+    value = int(cursor.fetchone()[1])
+    conn.close()
+    return value
+
+
+def run_once(args, mock: MockSUI, scenario: str, operation: str) -> Dict:
+    rows, clients = build_scenario(scenario, args)
+    recreate(args)
+    insert_services(args, rows)
+    if args.migrate:
+        migrate(args)
+    mock.load(clients)
+
+    with tempfile.TemporaryDirectory(prefix='xmplus-bench-') as state_dir:
+        config_path = os.path.join(state_dir, 'config.json')
+        with open(config_path, 'w') as f:
+            json.dump(child_config(args, mock.base_url, state_dir), f)
+
+        before = questions(args)
+        command = [sys.executable, os.path.abspath(__file__), '--measure', operation, '--config', config_path]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        # The second SHOW STATUS counts itself
+        statements = questions(args) - before - 1
+
+    result = json.loads(output)
+    result.update(scenario=scenario, operation=operation, db_statements=statements,
+                  api_calls=mock.call_counts())
+    return result
+
+
+def report(result: Dict) -> None:
+    calls = result['api_calls']
+    requests_made = sum(count for key, count in calls.items() if not key.startswith('items '))
+    print(f"\n{result['scenario']} / {result['operation']}: {result['result']}")
+    print(f"  wall time:   {result['seconds']:.3f} s")
+    print(f"  s-ui calls:  {requests_made} "
+          f"({', '.join(f'{key}={count}' for key, count in sorted(calls.items()))})")
+    print(f"  DB:          {result['db_statements']} statements, {result['db_checkouts']} pool checkouts")
+    print(f"  peak RSS:    {result['peak_rss_kb'] / 1024:.1f} MiB "
+          f"(+{result['rss_growth_kb'] / 1024:.1f} MiB during the run)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--churn', type=float, default=0.05)
+    parser.add_argument('--traffic-ratio', type=float, default=0.5)
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help="delay the mock s-ui adds to every request")
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help="run only this scenario (repeatable)")
+    parser.add_argument('--operation', action='append', choices=OPERATIONS,
+                        help="run only this operation (repeatable)")
+    parser.add_argument('--traffic-mode', choices=('reset', 'delta'), default='reset')
+    parser.add_argument('--batch-size', type=int, default=0,
+                        help="sync.batch_size; only the mock takes a JSON list for new and del")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--migrate', action='store_true',
+                        help="add the remaining column and index before each run")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', metavar='FILE', help="also write all results to FILE")
+    parser.add_argument('--measure', choices=OPERATIONS, help=argparse.SUPPRESS)
+    parser.add_argument('--config', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args)
+        return
+
+    mock = MockSUI(latency=args.latency_ms / 1000).start()
+    results = []
+    try:
+        for scenario in args.scenario or SCENARIOS:
+            for operation in args.operation or OPERATIONS:
+                result = run_once(args, mock, scenario, operation)
+                report(result)
+                results.append(result)
+    finally:
+        mock.stop()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
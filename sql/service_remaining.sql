@@ -0,0 +1,13 @@
+-- Indexed remaining-quota column for the XMPlus service table.
+--
+-- Lets sync_users select active services with a range scan on
+-- (status, remaining) instead of evaluating traffic - total_used for every
+-- status = 1 row. The sync detects the column automatically; without it the
+-- original expression is used.
+--
+-- Requires MySQL 5.7+ or MariaDB 10.2+. Run once against the XMPlus database:
+--   mysql -u <user> -p <database> < sql/service_remaining.sql
+
+ALTER TABLE service
+    ADD COLUMN remaining BIGINT AS (CAST(traffic AS SIGNED) - CAST(total_used AS SIGNED)) STORED,
+    ADD INDEX idx_service_status_remaining (status, remaining, uuid);
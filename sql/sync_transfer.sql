@@ -0,0 +1,13 @@
+-- Ledger of committed traffic charges for the XMPlus database.
+--
+-- Every traffic charge inserts its batch id here in the same transaction,
+-- so after a crash or a lost reply the sync can tell whether the charge
+-- committed instead of charging it again. The sync creates the table
+-- itself; run this once only when its MySQL user lacks CREATE privilege:
+--   mysql -u <user> -p <database> < sql/sync_transfer.sql
+
+CREATE TABLE IF NOT EXISTS sync_transfer (
+    batch CHAR(32) NOT NULL PRIMARY KEY,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_sync_transfer_created (created_at)
+);
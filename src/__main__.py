@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Modules in src/ import each other by bare name
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from bulk_save import chunked
+from client_index import Client
+from metrics import PHASE_SECONDS, phase_timer, reset_pass_charged
+
+DEFAULT_CHARGE_CHUNK = 500
+
+
+class AsyncSyncEngine:
+    """full_sync on asyncio, overlapping the XMPlus and s-ui I/O of one pass.
+
+    - the active-services query runs while /clients is fetched, and again right
+      after the last traffic charge when this pass charged anything, so users
+      that just ran out are still removed in the same pass;
+    - traffic is charged chunk by chunk while the s-ui resets of earlier chunks
+      are in flight;
+    - at most sync.concurrency s-ui requests are in flight.
+
+    The blocking clients of SyncService (the pooled requests session and the
+    MySQL pool) run in worker threads, so their pool sizes still bound the
+    connections in use, and the traffic journal is written as in sync_traffic.
+    """
+
+    def __init__(self, service, charge_chunk: int = DEFAULT_CHARGE_CHUNK):
+        self.service = service
+        self.charge_chunk = max(charge_chunk, 1)
+        self._sui_slots: Optional[asyncio.Semaphore] = None
+        self._active_query: Optional[asyncio.Task] = None
+
+    async def _in_thread(self, func, *args):
+        return await asyncio.to_thread(func, *args)
+
+    async def _sui_call(self, func, *args):
+        async with self._sui_slots:
+            return await asyncio.to_thread(func, *args)
+
+    async def _fetch_snapshot(self) -> Optional[List[Client]]:
+        with phase_timer('client_fetch'):
+            return await self._in_thread(self.service._fetch_clients)
+
+    async def _reset(self, client: Client, entry_id: int) -> Optional[int]:
+        token = client['name']
+        logging.debug("Processing %s: UP=%s, DOWN=%s", token, client.get('up', 0), client.get('down', 0))
+        try:
+            if await self._sui_call(self.service._reset_journaled, client, entry_id):
+                logging.debug("Successfully updated and reset traffic for %s", token)
+                return entry_id
+            logging.error("Failed to reset traffic in s-ui for %s", token)
+        except Exception as e:
+            logging.error("Error processing %s: %s", token, e)
+        return None
+
+    async def _sync_traffic_reset(self, unresolved: set) -> Tuple[int, bool]:
+        """Reset-mode traffic pass; returns (clients updated, whether anything was charged)"""
+        service = self.service
+        traffic_data = [client for client in service._get_traffic_data()
+                        if (client.get('down', 0) > 0 or client.get('up', 0) > 0)
+                        and client['name'] not in unresolved]
+        if not traffic_data:
+            logging.info("No clients with traffic")
+            return 0, False
+
+        # Journal every transfer before it is applied
+        journal = service._get_journal()
+        entry_ids = journal.begin('reset', [
+            (client['name'], client.get('id'), client.get('up', 0), client.get('down', 0),
+             client.get('up', 0), client.get('down', 0))
+            for client in traffic_data])
+
+        resets = []
+        charged_any = False
+        started = time.monotonic()
+        for chunk in chunked(traffic_data, self.charge_chunk):
+            # Resets of the chunks already charged run while this one is written
+            rowcounts = await self._in_thread(
+                service._charge_journaled, entry_ids,
+                [(client['name'], client.get('up', 0), client.get('down', 0)) for client in chunk])
+            if rowcounts is None:
+                # Left pending for the next pass to check
+                continue
+            charged = [client for client in chunk if rowcounts.get(client['name'])]
+            for client in chunk:
+                if not rowcounts.get(client['name']):
+                    logging.error("Failed to update traffic in XMPlus for %s", client['name'])
+            resets.extend(asyncio.create_task(self._reset(client, entry_ids[client['name']]))
+                          for client in charged)
+            charged_any = charged_any or bool(charged)
+
+        if charged_any:
+            self._requery_active_users()
+        done = [entry_id for entry_id in await asyncio.gather(*resets) if entry_id is not None]
+        PHASE_SECONDS.observe(time.monotonic() - started, phase='reset')
+
+        journal.purge()
+        return len(done), charged_any
+
+    async def _sync_traffic(self) -> int:
+        service = self.service
+        logging.info("Starting traffic synchronization")
+        reset_pass_charged()
+        unresolved = await self._in_thread(service._recover_traffic_journal)
+        if service.traffic_mode == 'delta':
+            updated = await self._in_thread(service._sync_traffic_delta, unresolved)
+            if updated:
+                self._requery_active_users()
+            return updated
+
+        updated, _ = await self._sync_traffic_reset(unresolved)
+        return updated
+
+    def _requery_active_users(self) -> None:
+        """Read the active services again, now that this pass's charges are committed"""
+        previous = self._active_query
+        if previous is not None:
+            # Its result predates the charges; keep a failure from being reported as unretrieved
+            previous.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self._active_query = asyncio.create_task(self._in_thread(self.service._query_active_users))
+
+    async def _sync_users(self) -> Tuple[int, int]:
+        service = self.service
+        try:
+            if self._active_query is None:
+                return await self._in_thread(service.sync_users)
+            active_uuids, change_value = await self._active_query
+            return await self._in_thread(service._apply_user_diff, active_uuids, change_value)
+        except Exception as e:
+            logging.exception("Error in sync_users: %s", e)
+            return 0, 0
+
+    async def full_sync(self) -> Dict[str, int]:
+        service = self.service
+        self._sui_slots = asyncio.Semaphore(max(service.concurrency, 1))
+        if not service._wants_incremental_users():
+            # Nothing has been charged yet, so this result holds unless traffic is charged below
+            self._active_query = asyncio.create_task(self._in_thread(service._query_active_users))
+
+        clients = await self._fetch_snapshot()
+        with service._pinned_clients(clients):
+            logging.info("Syncing traffic...")
+            traffic_updated = await self._sync_traffic()
+
+            logging.info("Syncing users...")
+            users_added, users_removed = await self._sync_users()
+
+        return {
+            'traffic_updated': traffic_updated,
+            'users_added': users_added,
+            'users_removed': users_removed
+        }
+
+
+def run_full_sync(service, charge_chunk: int = DEFAULT_CHARGE_CHUNK) -> Dict[str, int]:
+    """Run one full_sync pass of service on a fresh event loop"""
+    return asyncio.run(AsyncSyncEngine(service, charge_chunk).full_sync())
@@ -0,0 +1,43 @@
+from typing import Callable, Iterable, Iterator, List, Optional, TypeVar
+
+from executor import run_bounded
+
+T = TypeVar('T')
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    chunk: List[T] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def save_in_batches(items: Iterable[T], batch_size: int,
+                    save_batch: Callable[[List[T]], Optional[bool]],
+                    save_one: Callable[[T], bool],
+                    concurrency: int = 1) -> List[T]:
+    """Save items chunk by chunk, retrying a rejected chunk one item at a time.
+
+    Returns the items that were saved. save_batch returns None when it is
+    unknown whether the chunk was applied; its items are then left for the
+    next pass instead of being sent again. A batch_size of 1 or less
+    disables batching and every item goes through save_one. Up to
+    concurrency chunks are saved at the same time.
+    """
+    def save_chunk(chunk: List[T]) -> List[T]:
+        if len(chunk) > 1:
+            saved = save_batch(chunk)
+            if saved:
+                return chunk
+            if saved is None:
+                return []
+        return [item for item in chunk if save_one(item)]
+
+    saved: List[T] = []
+    for chunk_saved in run_bounded(save_chunk, chunked(items, max(batch_size, 1)), concurrency):
+        saved.extend(chunk_saved)
+    return saved
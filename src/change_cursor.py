@@ -0,0 +1,64 @@
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class ChangeCursor:
+    """Persisted high-water mark of an XMPlus column, used for incremental user sync.
+
+    Stored next to the traffic checkpoint in the local state database along
+    with the time of the last full reconcile.
+    """
+
+    def __init__(self, path: str, name: str = 'service'):
+        self.path = path
+        self.name = name
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS change_cursor (
+                name TEXT PRIMARY KEY,
+                value TEXT,
+                full_sync_at INTEGER NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def _row(self) -> Optional[tuple]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT value, full_sync_at FROM change_cursor WHERE name = ?", (self.name,)).fetchone()
+
+    @property
+    def value(self) -> Optional[str]:
+        row = self._row()
+        return row[0] if row else None
+
+    def needs_full_sync(self, interval: float) -> bool:
+        """True when there is no cursor yet or the last full reconcile is older than interval"""
+        row = self._row()
+        return row is None or row[0] is None or time.time() - row[1] >= interval
+
+    def advance(self, value) -> None:
+        if value is None:
+            return
+        with self._lock:
+            self._conn.execute(
+                "UPDATE change_cursor SET value = ? WHERE name = ?", (str(value), self.name))
+            self._conn.commit()
+
+    def mark_full_sync(self, value) -> None:
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO change_cursor (name, value, full_sync_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    value = excluded.value,
+                    full_sync_at = excluded.full_sync_at
+            """, (self.name, None if value is None else str(value), int(time.time())))
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
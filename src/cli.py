@@ -0,0 +1,171 @@
+import argparse
+import logging
+import os
+import runpy
+import sys
+import time
+from typing import List, Optional
+
+from daemon import DEFAULT_LOCK_PATH, sync_lock
+from metrics import LAST_SUCCESS
+from sync_logging import RunSummary
+from sync_plan import SyncPlan
+from sync_service import DEFAULT_CONFIG_PATH, SyncService, load_config
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench')
+BENCHMARKS = {
+    'query': 'active_query.py',
+    'sync': 'sync_scenarios.py'
+}
+
+
+def _users(syncer: SyncService, args) -> None:
+    if args.dry_run:
+        to_add, to_remove = syncer.preview_users()
+        print(f"Would add {len(to_add)} users, remove {len(to_remove)} users")
+        for username in sorted(to_add):
+            print(f"+ {username}")
+        for username in sorted(to_remove):
+            print(f"- {username}")
+        return
+
+    summary = RunSummary('sync_users')
+    added, removed = syncer.sync_users()
+    LAST_SUCCESS.set(time.time())
+    summary.add(users_added=added, users_removed=removed)
+    summary.emit()
+
+
+def _traffic(syncer: SyncService, args) -> None:
+    summary = RunSummary('sync_traffic')
+    updated = syncer.sync_traffic()
+    LAST_SUCCESS.set(time.time())
+    summary.add(traffic_updated=updated, traffic_mode=syncer.traffic_mode,
+                sui_latency=syncer.sui.latency_stats())
+    summary.emit()
+
+
+def _full(syncer: SyncService, args) -> None:
+    syncer.full_sync()
+
+
+def _plan(syncer: SyncService, args) -> None:
+    if args.apply:
+        syncer.apply_plan(SyncPlan.load(args.apply))
+        return
+    plan = syncer.build_plan()
+    plan.save(args.output)
+    logging.info("Plan: %s", plan.totals())
+
+
+def _journal(syncer: SyncService, args) -> None:
+    if args.action == 'resolve':
+        for entry_id in args.entry_ids:
+            syncer.resolve_held_transfer(entry_id, args.applied)
+        return
+
+    entries = syncer.held_transfers(include_unfinished=args.all)
+    print(f"{len(entries)} {'unfinished' if args.all else 'held'} journal entries")
+    for entry in entries:
+        updated = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['updated_at']))
+        print(f"{entry['id']} {entry['state']} {entry['mode']} {entry['name']} "
+              f"counters={entry['up']}/{entry['down']} charged={entry['charged_up']}/{entry['charged_down']} "
+              f"updated={updated}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='xmplus-hysteria2',
+                                     description="Sync XMPlus services and traffic with s-ui")
+    parser.add_argument('--config', default=DEFAULT_CONFIG_PATH,
+                        help=f"path to config.json (default {DEFAULT_CONFIG_PATH})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    users = commands.add_parser('users', help="add and remove s-ui users to match XMPlus")
+    users.add_argument('--dry-run', action='store_true',
+                       help="show which users the rules would add and remove, then exit")
+    users.set_defaults(func=_users)
+
+    traffic = commands.add_parser('traffic', help="charge s-ui traffic to XMPlus")
+    traffic.set_defaults(func=_traffic)
+
+    full = commands.add_parser('full', help="traffic, then users")
+    full.set_defaults(func=_full)
+
+    commands.add_parser('daemon', help="keep running and sync every sync.interval seconds")
+
+    plan = commands.add_parser('plan', help="write the changes a full sync would make, or apply a saved plan")
+    plan.add_argument('-o', '--output', default='-', metavar='FILE',
+                      help="where to write the plan JSON (default stdout)")
+    plan.add_argument('--apply', metavar='FILE',
+                      help="apply a plan written earlier instead of computing a new one")
+    plan.set_defaults(func=_plan)
+
+    journal = commands.add_parser('journal', help="list or resolve traffic transfers held for review")
+    journal_actions = journal.add_subparsers(dest='action', required=True)
+    journal_list = journal_actions.add_parser('list', help="show held entries; their clients are not synced")
+    journal_list.add_argument('--all', action='store_true',
+                              help="show every unfinished entry, not only held ones")
+    resolve = journal_actions.add_parser('resolve', help="settle held entries after checking s-ui")
+    resolve.add_argument('entry_ids', nargs='+', type=int, metavar='ID', help="journal entry id")
+    outcome = resolve.add_mutually_exclusive_group(required=True)
+    outcome.add_argument('--applied', dest='applied', action='store_true',
+                         help="the reset went through: the counters now only hold usage since then")
+    outcome.add_argument('--not-applied', dest='applied', action='store_false',
+                         help="the reset was lost: the next pass takes the charged bytes off the counters")
+    journal.set_defaults(func=_journal)
+
+    bench = commands.add_parser('bench', help="run a benchmark from bench/ against a scratch database")
+    bench.add_argument('benchmark', choices=sorted(BENCHMARKS),
+                       help="query: active-services query, sync: sync scenarios against a mock s-ui")
+    bench.add_argument('bench_args', nargs=argparse.REMAINDER,
+                       help="arguments passed to the benchmark")
+    return parser
+
+
+def _run_bench(benchmark: str, bench_args: List[str]) -> None:
+    script = os.path.join(BENCH_DIR, BENCHMARKS[benchmark])
+    # Benchmarks import their helpers from bench/ as when run directly
+    sys.path.insert(0, BENCH_DIR)
+    sys.argv = [script] + bench_args
+    runpy.run_path(script, run_name='__main__')
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'bench':
+        _run_bench(args.benchmark, args.bench_args)
+        return 0
+
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError) as e:
+        parser.error(f"cannot read config {args.config}: {e}")
+    syncer = SyncService(config)
+    try:
+        if args.command == 'daemon':
+            syncer.run_daemon()
+            return 0
+
+        # Read-only commands need no lock
+        if (args.command == 'users' and args.dry_run or args.command == 'plan' and not args.apply
+                or args.command == 'journal' and args.action == 'list'):
+            args.func(syncer, args)
+            return 0
+
+        lock_path = syncer.config.get('sync', {}).get('lock_path', DEFAULT_LOCK_PATH)
+        with sync_lock(lock_path) as acquired:
+            if not acquired:
+                logging.info("Another sync is already running, skipping")
+                return 0
+            args.func(syncer, args)
+            if args.command != 'journal':
+                # Resolving entries is no sync pass; keep the metrics of the last one
+                syncer.write_metrics()
+        return 0
+    except Exception as e:
+        logging.exception("Sync failed: %s", e)
+        return 1
+    finally:
+        if args.command != 'daemon':
+            syncer.close()
@@ -0,0 +1,85 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+
+class ClientRecord:
+    """The fields of an s-ui client the sync works with, without its config and links.
+
+    Reads and writes like the client dict it replaces, so code taking either
+    keeps using client['name'] and client.get('up', 0).
+    """
+    __slots__ = ('id', 'name', 'enable', 'up', 'down')
+
+    def __init__(self, client_id: Optional[int], name: str, enable: bool = True, up: int = 0, down: int = 0):
+        self.id = client_id
+        self.name = name
+        self.enable = enable
+        self.up = up
+        self.down = down
+
+    @classmethod
+    def from_dict(cls, client: Dict) -> 'ClientRecord':
+        return cls(client.get('id'), client['name'], bool(client.get('enable', True)),
+                   client.get('up') or 0, client.get('down') or 0)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+
+    def __getitem__(self, key: str):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def as_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+Client = Union[Dict, ClientRecord]
+
+
+class ClientIndex:
+    """In-memory name -> client record index built from one /clients snapshot"""
+
+    def __init__(self, clients: Optional[Iterable[Client]] = None):
+        self._by_name: Dict[str, Client] = {}
+        if clients:
+            for client in clients:
+                self.add(client)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._by_name
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def __iter__(self) -> Iterator[Client]:
+        return iter(self._by_name.values())
+
+    def add(self, client: Client) -> None:
+        if isinstance(client, (dict, ClientRecord)) and 'name' in client:
+            self._by_name[client['name']] = client
+
+    def remove(self, name: str) -> Optional[Client]:
+        return self._by_name.pop(name, None)
+
+    def get(self, name: str) -> Optional[Client]:
+        return self._by_name.get(name)
+
+    def get_id(self, name: str) -> Optional[int]:
+        client = self._by_name.get(name)
+        if client is None:
+            return None
+        return client.get('id')
+
+    def names(self) -> set:
+        return set(self._by_name)
+
+    def clients(self) -> List[Client]:
+        return list(self._by_name.values())
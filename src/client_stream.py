@@ -0,0 +1,141 @@
+import codecs
+import json
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from client_index import Client, ClientRecord
+
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+class _StreamReader:
+    """Walks JSON text that arrives in chunks, decoding one value at a time.
+
+    Only the unread tail of the text and the value being decoded are held in
+    memory, so a large array can be consumed element by element.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """Append the next chunk to the unread text; False once the stream is exhausted"""
+        if self._eof:
+            return False
+        for chunk in self._chunks:
+            if chunk:
+                self._buffer = self._buffer[self._pos:] + self._decoder.decode(chunk)
+                self._pos = 0
+                return True
+        self._buffer = self._buffer[self._pos:] + self._decoder.decode(b'', final=True)
+        self._pos = 0
+        self._eof = True
+        return False
+
+    def _error(self, message: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(message, self._buffer, self._pos)
+
+    def peek(self) -> str:
+        """Next non-whitespace character, or '' at the end of the text"""
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise self._error(f"Expecting {char!r}")
+        self._pos += 1
+
+    def value(self):
+        """Decode the next complete value"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # Most likely cut off by the chunk boundary
+                if not self._fill():
+                    raise
+                continue
+            # A number at the very end of the buffer may go on in the next chunk
+            if end < len(self._buffer) or not self._fill():
+                self._pos = end
+                return value
+
+    def _separator(self, close: str) -> bool:
+        """Consume ',' or the closing bracket; True when there are more members"""
+        char = self.peek()
+        if char == ',':
+            self._pos += 1
+            return True
+        if char == close:
+            self._pos += 1
+            return False
+        raise self._error(f"Expecting ',' or {close!r}")
+
+    def members(self) -> Iterator[str]:
+        """Keys of the object starting here; the caller must read or skip each value"""
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise self._error("Expecting property name enclosed in double quotes")
+            key = self.value()
+            self.expect(':')
+            yield key
+            if not self._separator('}'):
+                return
+
+    def items(self) -> Iterator:
+        """Decoded elements of the array starting here"""
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if not self._separator(']'):
+                return
+
+
+def parse_clients_response(chunks: Iterable[bytes],
+                           keep_full: Optional[Callable[[Dict], bool]] = None
+                           ) -> Tuple[bool, str, List[Client]]:
+    """(success, msg, clients) from a /clients response body given in chunks.
+
+    Each client is decoded on its own and reduced to a ClientRecord, so its
+    config and links are dropped as soon as it is read instead of the whole
+    list being held at once. Clients keep_full accepts stay full dicts.
+    """
+    reader = _StreamReader(chunks)
+    success, msg, clients = False, '', []
+    for key in reader.members():
+        if key == 'obj' and reader.peek() == '{':
+            for obj_key in reader.members():
+                if obj_key == 'clients' and reader.peek() == '[':
+                    clients = [client if keep_full is not None and keep_full(client)
+                               else ClientRecord.from_dict(client)
+                               for client in reader.items() if isinstance(client, dict) and 'name' in client]
+                else:
+                    reader.value()
+        elif key == 'success':
+            success = bool(reader.value())
+        elif key == 'msg':
+            msg = reader.value()
+        else:
+            reader.value()
+    if reader.peek():
+        raise reader._error("Extra data")
+    return success, msg, clients
@@ -0,0 +1,166 @@
+import json
+import secrets
+import uuid
+from base64 import b64encode
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from client_index import ClientRecord
+from inbounds import DEFAULT_INBOUND_ID, DEFAULT_PORT, Inbound, InboundMap
+
+PROTOCOLS = ('mixed', 'socks', 'http', 'shadowsocks', 'shadowsocks16', 'shadowtls', 'vmess',
+             'vless', 'trojan', 'naive', 'hysteria', 'tuic', 'hysteria2')
+
+# Placeholder characters json.dumps escapes to \u001d, so they split cleanly
+_MARK = '\x1d'
+_ESCAPED_MARK = json.dumps(_MARK)[1:-1]
+
+SS_BYTES = 32
+SS16_BYTES = 16
+UUID_BYTES = 16
+
+
+def _slot(name: str) -> str:
+    return f"{_MARK}{name}{_MARK}"
+
+
+def _protocol_configs(protocols: Sequence[str]) -> Dict[str, Dict]:
+    name, token = _slot('name'), _slot('token')
+    configs = {
+        "mixed": {"username": name, "password": token},
+        "socks": {"username": name, "password": token},
+        "http": {"username": name, "password": token},
+        "shadowsocks": {"name": name, "password": _slot('ss')},
+        "shadowsocks16": {"name": name, "password": _slot('ss16')},
+        "shadowtls": {"name": name, "password": _slot('ss')},
+        "vmess": {"name": name, "uuid": _slot('uuid'), "alterId": 0},
+        "vless": {"name": name, "uuid": _slot('uuid'), "flow": "xtls-rprx-vision"},
+        "trojan": {"name": name, "password": token},
+        "naive": {"username": name, "password": token},
+        "hysteria": {"name": name, "auth_str": token},
+        "tuic": {"name": name, "uuid": _slot('uuid'), "password": token},
+        "hysteria2": {"name": name, "password": token}
+    }
+    return {protocol: configs[protocol] for protocol in PROTOCOLS if protocol in protocols}
+
+
+class NewClient:
+    """A client ready for /save: its name and the JSON s-ui receives"""
+    __slots__ = ('name', 'payload')
+
+    def __init__(self, name: str, payload: str):
+        self.name = name
+        self.payload = payload
+
+    def record(self) -> ClientRecord:
+        """Compact client index entry; s-ui assigns the id"""
+        return ClientRecord(None, self.name)
+
+
+class ClientTemplate:
+    """Builds new s-ui clients from pre-serialized templates.
+
+    The JSON of a client is split once into static fragments around the
+    per-user values, so a client is a string join. There is one template per
+    inbound assignment, each with a hysteria2 link for every inbound the user
+    is on. Random credentials for a batch come from a single draw, and only
+    for the protocols in use.
+    """
+
+    def __init__(self, server_ip: str, obfs_password: str,
+                 protocols: Sequence[str] = PROTOCOLS, inbound_map: Optional[InboundMap] = None):
+        unknown = set(protocols) - set(PROTOCOLS)
+        if unknown or not protocols:
+            raise ValueError(f"Unknown client protocols: {sorted(unknown) or 'none given'}")
+        self.protocols = tuple(protocols)
+        self.server_ip = server_ip
+        self.obfs_password = obfs_password
+        self.inbound_map = inbound_map or InboundMap([Inbound(DEFAULT_INBOUND_ID, DEFAULT_PORT)])
+        self._config = _protocol_configs(self.protocols)
+        self._compiled: Dict[Tuple[int, ...], Tuple[List[str], List[str]]] = {}
+
+        used = set(json.dumps(self._config).split(_ESCAPED_MARK)[1::2])
+        self._needs_ss = 'ss' in used
+        self._needs_ss16 = 'ss16' in used
+        self._needs_uuid = 'uuid' in used
+
+    def _compile(self, inbounds: Tuple[Inbound, ...]) -> Tuple[List[str], List[str]]:
+        token, name = _slot('token'), _slot('name')
+        client = {
+            "enable": True,
+            "name": name,
+            "config": self._config,
+            "inbounds": [inbound.id for inbound in inbounds],
+            "links": [{
+                "remark": f"hysteria2-{inbound.ports}",
+                "type": "local",
+                "uri": f"hysteria2://{token}@{self.server_ip}:{inbound.ports}?fastopen=0&obfs=salamander"
+                       f"&obfs-password={self.obfs_password}#{name}"
+            } for inbound in inbounds],
+            "volume": 0,
+            "expiry": 0,
+            "up": 0,
+            "down": 0,
+            "desc": "",
+            "group": ""
+        }
+        # Alternating static JSON and slot names: fragment, slot, fragment, ...
+        pieces = json.dumps(client).split(_ESCAPED_MARK)
+        return pieces[0::2], pieces[1::2]
+
+    def _template_for(self, username: str) -> Tuple[List[str], List[str]]:
+        inbounds = self.inbound_map.for_user(username)
+        key = tuple(inbound.id for inbound in inbounds)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = self._compiled[key] = self._compile(inbounds)
+        return compiled
+
+    @classmethod
+    def from_config(cls, config: Dict, server_ip: str, inbound_map: InboundMap) -> 'ClientTemplate':
+        """node.protocols lists the config entries new clients get; empty means all of them"""
+        protocols = config.get('node', {}).get('protocols') or PROTOCOLS
+        return cls(server_ip, config['obfs_password'], protocols, inbound_map)
+
+    def _random_values(self, count: int) -> List[Dict[str, str]]:
+        per_client = ((SS_BYTES if self._needs_ss else 0) + (SS16_BYTES if self._needs_ss16 else 0)
+                      + (UUID_BYTES if self._needs_uuid else 0))
+        pool = secrets.token_bytes(per_client * count) if per_client else b''
+        values = []
+        offset = 0
+        for _ in range(count):
+            client = {}
+            if self._needs_ss:
+                client['ss'] = b64encode(pool[offset:offset + SS_BYTES]).decode()
+                offset += SS_BYTES
+            if self._needs_ss16:
+                client['ss16'] = b64encode(pool[offset:offset + SS16_BYTES]).decode()
+                offset += SS16_BYTES
+            if self._needs_uuid:
+                client['uuid'] = str(uuid.UUID(bytes=pool[offset:offset + UUID_BYTES], version=4))
+                offset += UUID_BYTES
+            values.append(client)
+        return values
+
+    def render(self, username: str, values: Dict[str, str]) -> str:
+        fragments, slots = self._template_for(username)
+        parts = [fragments[0]]
+        for slot, fragment in zip(slots, fragments[1:]):
+            parts.append(values[slot])
+            parts.append(fragment)
+        return ''.join(parts)
+
+    def build(self, users: Iterable[Tuple[str, str]]) -> List[NewClient]:
+        """NewClient for each (username, token)"""
+        users = list(users)
+        clients = []
+        for (username, token), values in zip(users, self._random_values(len(users))):
+            # Inside JSON strings: escape, without the surrounding quotes
+            values['name'] = json.dumps(username)[1:-1]
+            values['token'] = json.dumps(token)[1:-1]
+            clients.append(NewClient(username, self.render(username, values)))
+        return clients
+
+
+def batch_payload(clients: Sequence[NewClient]) -> str:
+    """JSON list of the clients for one bulk /save"""
+    return '[' + ','.join(client.payload for client in clients) + ']'
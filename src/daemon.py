@@ -0,0 +1,92 @@
+import fcntl
+import logging
+import random
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+DEFAULT_LOCK_PATH = '/tmp/xmplus-hysteria2.lock'
+
+
+@contextmanager
+def sync_lock(path: str = DEFAULT_LOCK_PATH) -> Iterator[bool]:
+    """Non-blocking inter-process lock; yields False if another run holds it"""
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SyncDaemon:
+    """Run a sync callable every interval seconds until SIGTERM or SIGINT.
+
+    Cycles never overlap: they run serially in this process and take the same
+    file lock as one-shot cron runs. A signal lets the running cycle finish
+    before the loop exits.
+    """
+
+    def __init__(self, sync: Callable[[], Dict], interval: float, jitter: float = 0.1,
+                 lock_path: str = DEFAULT_LOCK_PATH,
+                 on_stop: Optional[Callable[[], None]] = None):
+        self.sync = sync
+        self.interval = interval
+        self.jitter = jitter
+        self.lock_path = lock_path
+        self.on_stop = on_stop
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_config(cls, sync: Callable[[], Dict], config: Dict,
+                    on_stop: Optional[Callable[[], None]] = None) -> 'SyncDaemon':
+        sync_config = config.get('sync', {})
+        return cls(
+            sync,
+            interval=float(sync_config.get('interval', 300)),
+            jitter=float(sync_config.get('jitter', 0.1)),
+            lock_path=sync_config.get('lock_path', DEFAULT_LOCK_PATH),
+            on_stop=on_stop
+        )
+
+    def stop(self, signum: Optional[int] = None, frame=None) -> None:
+        if signum is not None:
+            logging.info("Received signal %s, stopping after the current cycle", signum)
+        self._stop.set()
+
+    def _next_delay(self) -> float:
+        return max(0.0, self.interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def run_once(self) -> Optional[Dict]:
+        with sync_lock(self.lock_path) as acquired:
+            if not acquired:
+                logging.warning("Previous sync still running, skipping this cycle")
+                return None
+            try:
+                return self.sync()
+            except Exception as e:
+                logging.exception("Sync cycle failed: %s", e)
+                return None
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        # Spread the first cycle so several nodes started together don't align
+        self._stop.wait(random.uniform(0, self.interval * self.jitter))
+        try:
+            while not self._stop.is_set():
+                started = time.monotonic()
+                self.run_once()
+                elapsed = time.monotonic() - started
+                self._stop.wait(max(0.0, self._next_delay() - elapsed))
+        finally:
+            if self.on_stop is not None:
+                self.on_stop()
+            logging.info("Sync daemon stopped")
@@ -0,0 +1,178 @@
+import datetime
+import re
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sharding import NodeShard
+
+DEFAULT_MIN_REMAINING = 200000000
+
+
+def checked_column(column: str) -> str:
+    if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', column):
+        raise ValueError(f"Invalid column name: {column}")
+    return column
+
+
+class EligibilityRules:
+    """Which XMPlus services belong in this node's s-ui, from the rules config section.
+
+    The same rules compile into one parameterized SQL query for full syncs and
+    evaluate in memory for incrementally read rows and dry runs, so both
+    paths always agree.
+    """
+
+    def __init__(self, statuses: Sequence[int] = (1,),
+                 min_remaining: int = DEFAULT_MIN_REMAINING,
+                 require_unexpired: bool = False, expiry_column: str = 'expire_date',
+                 expiry_format: str = 'datetime',
+                 plan_ids: Sequence = (), plan_column: str = 'pid',
+                 server_ids: Sequence = (), server_column: str = 'server_id',
+                 max_users: int = 0, shard: Optional[NodeShard] = None):
+        self.statuses = tuple(statuses)
+        self.min_remaining = int(min_remaining)
+        self.require_unexpired = require_unexpired
+        self.expiry_column = checked_column(expiry_column)
+        self.expiry_format = expiry_format
+        self.plan_ids = tuple(plan_ids)
+        self.plan_column = checked_column(plan_column)
+        self.server_ids = tuple(server_ids)
+        self.server_column = checked_column(server_column)
+        self.max_users = int(max_users)
+        self.shard = shard
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'EligibilityRules':
+        rules = config.get('rules', {})
+        # A node pinned to an XMPlus server id shards by column instead of by hash
+        server_id = config.get('node', {}).get('server_id')
+        return cls(
+            statuses=rules.get('statuses', [1]),
+            min_remaining=rules.get('min_remaining', DEFAULT_MIN_REMAINING),
+            require_unexpired=bool(rules.get('require_unexpired', False)),
+            expiry_column=rules.get('expiry_column', 'expire_date'),
+            expiry_format=rules.get('expiry_format', 'datetime'),
+            plan_ids=rules.get('plan_ids', []),
+            plan_column=rules.get('plan_column', 'pid'),
+            server_ids=rules.get('server_ids') or ([server_id] if server_id is not None else []),
+            server_column=rules.get('server_column', 'server_id'),
+            max_users=rules.get('max_users', 0),
+            shard=NodeShard.from_config(config)
+        )
+
+    def _now(self):
+        if self.expiry_format == 'unix':
+            return int(time.time())
+        return datetime.datetime.now()
+
+    def columns(self) -> List[str]:
+        """service columns needed to evaluate the rules in memory"""
+        columns = ['id', 'uuid', 'status', 'traffic', 'total_used']
+        if self.require_unexpired:
+            columns.append(self.expiry_column)
+        if self.plan_ids:
+            columns.append(self.plan_column)
+        if self.server_ids:
+            columns.append(self.server_column)
+        return columns
+
+    def where(self, use_remaining_column: bool = False) -> Tuple[str, list]:
+        conditions = []
+        params: list = []
+        if self.statuses:
+            conditions.append(f"status IN ({', '.join(['%s'] * len(self.statuses))})")
+            params.extend(self.statuses)
+        if use_remaining_column:
+            # Range predicate on the indexed generated column from sql/service_remaining.sql
+            conditions.append("remaining > %s")
+        else:
+            conditions.append("traffic - total_used > %s")
+        params.append(self.min_remaining)
+        if self.require_unexpired:
+            conditions.append(f"(`{self.expiry_column}` IS NULL OR `{self.expiry_column}` > %s)")
+            params.append(self._now())
+        if self.plan_ids:
+            conditions.append(f"`{self.plan_column}` IN ({', '.join(['%s'] * len(self.plan_ids))})")
+            params.extend(self.plan_ids)
+        if self.server_ids:
+            conditions.append(f"`{self.server_column}` IN ({', '.join(['%s'] * len(self.server_ids))})")
+            params.extend(self.server_ids)
+        return ' AND '.join(conditions), params
+
+    def compile(self, use_remaining_column: bool = False,
+                select: Sequence[str] = ('uuid',)) -> Tuple[str, list]:
+        """Single parameterized query selecting the eligible services"""
+        where, params = self.where(use_remaining_column)
+        columns = ', '.join(f"`{checked_column(column)}`" for column in select)
+        query = f"SELECT {columns} FROM service WHERE {where}"
+        if self.max_users:
+            # Oldest services first, so the same subset is kept from run to run
+            query += " ORDER BY id"
+            if self.shard is None:
+                query += " LIMIT %s"
+                params.append(self.max_users)
+        return query, params
+
+    def owns(self, uuid: str) -> bool:
+        """Whether the service is assigned to this node; the limit then applies after sharding"""
+        return self.shard is None or self.shard.owns(uuid)
+
+    def room(self, current: int) -> Optional[int]:
+        """How many more services fit under max_users, None when unlimited"""
+        if not self.max_users:
+            return None
+        return max(self.max_users - current, 0)
+
+    def matches(self, row: Dict, now=None) -> bool:
+        if self.statuses and row['status'] not in self.statuses:
+            return False
+        if row['traffic'] - row['total_used'] <= self.min_remaining:
+            return False
+        if self.require_unexpired:
+            expiry = row.get(self.expiry_column)
+            if expiry is not None and expiry <= (now if now is not None else self._now()):
+                return False
+        if self.plan_ids and row.get(self.plan_column) not in self.plan_ids:
+            return False
+        if self.server_ids and row.get(self.server_column) not in self.server_ids:
+            return False
+        return self.owns(row['uuid'])
+
+    def evaluate(self, columns: Dict[str, Sequence], now=None) -> List[bool]:
+        """Evaluate the rules column-wise over a table of services.
+
+        columns maps each name from columns() to an equally long sequence.
+        Each condition is applied to a whole column at once and the masks are
+        combined, which is much cheaper than matches() per row for dry runs
+        over the full service table. max_users is applied in id order.
+        """
+        count = len(columns['uuid'])
+        mask = [True] * count
+        if self.statuses:
+            statuses = set(self.statuses)
+            mask = [m and s in statuses for m, s in zip(mask, columns['status'])]
+        min_remaining = self.min_remaining
+        mask = [m and t - u > min_remaining
+                for m, t, u in zip(mask, columns['traffic'], columns['total_used'])]
+        if self.require_unexpired:
+            now = now if now is not None else self._now()
+            mask = [m and (e is None or e > now) for m, e in zip(mask, columns[self.expiry_column])]
+        if self.plan_ids:
+            plans = set(self.plan_ids)
+            mask = [m and p in plans for m, p in zip(mask, columns[self.plan_column])]
+        if self.server_ids:
+            servers = set(self.server_ids)
+            mask = [m and s in servers for m, s in zip(mask, columns[self.server_column])]
+        if self.shard is not None:
+            owns = self.shard.owns
+            mask = [m and owns(u) for m, u in zip(mask, columns['uuid'])]
+
+        if self.max_users and sum(mask) > self.max_users:
+            kept = sorted((i for i, m in enumerate(mask) if m), key=lambda i: columns['id'][i])
+            allowed = set(kept[:self.max_users])
+            mask = [i in allowed for i in range(count)]
+        return mask
+
+    def select(self, columns: Dict[str, Sequence], now=None) -> List[str]:
+        """uuids of the eligible services in a column table"""
+        return [uuid for uuid, keep in zip(columns['uuid'], self.evaluate(columns, now)) if keep]
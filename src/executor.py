@@ -0,0 +1,41 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all threads"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def run_bounded(func: Callable[[T], R], items: Iterable[T], concurrency: int) -> List[R]:
+    """Apply func to every item with at most concurrency calls in flight.
+
+    Results keep the order of items. With a concurrency of 1 or less the
+    calls run serially in the current thread.
+    """
+    items = list(items)
+    if concurrency <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    workers = min(concurrency, len(items))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sync') as pool:
+        return list(pool.map(func, items))
@@ -0,0 +1,83 @@
+import hashlib
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_INBOUND_ID = 1
+DEFAULT_PORT = 443
+
+
+class Inbound:
+    """One s-ui Hysteria2 inbound and the ports clients may reach it on"""
+    __slots__ = ('id', 'port', 'hop_ports')
+
+    def __init__(self, inbound_id: int, port: int = DEFAULT_PORT, hop_ports: str = ''):
+        self.id = int(inbound_id)
+        self.port = int(port)
+        self.hop_ports = hop_ports
+
+    @property
+    def ports(self) -> str:
+        """Port part of the link: the listen port, plus the hopping range when there is one"""
+        return f"{self.port},{self.hop_ports}" if self.hop_ports else str(self.port)
+
+    @classmethod
+    def from_config(cls, entry: Dict) -> 'Inbound':
+        return cls(entry['id'], entry.get('port', DEFAULT_PORT), str(entry.get('hop_ports') or ''))
+
+
+def _score(inbound_id: int, name: str) -> int:
+    return int.from_bytes(hashlib.blake2b(f"{inbound_id}:{name}".encode(), digest_size=8).digest(), 'big')
+
+
+class InboundMap:
+    """Spreads users evenly across the node's inbounds by rendezvous hashing of their name.
+
+    Adding an inbound only moves the users that now score highest on it, and
+    with a handful of inbounds the split stays even, unlike a small hash ring.
+    """
+
+    def __init__(self, inbounds: Sequence[Inbound], per_user: int = 1):
+        if not inbounds:
+            raise ValueError("At least one inbound is needed")
+        self.inbounds = list(inbounds)
+        self.per_user = max(1, min(per_user, len(self.inbounds)))
+
+    def for_user(self, name: str) -> Tuple[Inbound, ...]:
+        """The per_user inbounds that score highest for this user, best first"""
+        if len(self.inbounds) == 1:
+            return (self.inbounds[0],)
+        ranked = sorted(self.inbounds, key=lambda inbound: _score(inbound.id, name), reverse=True)
+        return tuple(ranked[:self.per_user])
+
+    @classmethod
+    def from_config(cls, config: Dict, discovered: Optional[List[Inbound]] = None) -> 'InboundMap':
+        """Inbounds from node.inbounds, or the discovered ones with hop_ports taken from config.
+
+        Without either, every user goes on inbound 1 at port 443 as before.
+        """
+        node = config.get('node', {})
+        configured = [Inbound.from_config(entry) for entry in node.get('inbounds') or []]
+        per_user = int(node.get('inbounds_per_user', 1))
+        if discovered:
+            hops = {inbound.id: inbound.hop_ports for inbound in configured}
+            return cls([Inbound(inbound.id, inbound.port, hops.get(inbound.id, ''))
+                        for inbound in discovered], per_user)
+        return cls(configured or [Inbound(DEFAULT_INBOUND_ID, DEFAULT_PORT)], per_user)
+
+
+def discover_inbounds(sui) -> List[Inbound]:
+    """Hysteria2 inbounds configured in s-ui, or an empty list when they cannot be read"""
+    try:
+        response = sui.get('inbounds')
+        response.raise_for_status()
+        data = response.json()
+    except Exception as e:
+        logging.error("Error reading s-ui inbounds: %s", e)
+        return []
+    if not data.get('success'):
+        logging.error("API returned error: %s", data.get('msg'))
+        return []
+
+    inbounds = (data.get('obj') or {}).get('inbounds') or []
+    return [Inbound(inbound['id'], inbound.get('listen_port', DEFAULT_PORT))
+            for inbound in inbounds if inbound.get('type') == 'hysteria2' and 'id' in inbound]
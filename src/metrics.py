@@ -0,0 +1,254 @@
+import abc
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(abc.ABC):
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    @property
+    def family(self) -> str:
+        """Name in the HELP and TYPE lines, which must match the sample names"""
+        return self.name
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """Sample lines of this metric in the text format"""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.family} {self.documentation}", f"# TYPE {self.family} {self.kind}"]
+        return lines + self.samples()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    @property
+    def family(self) -> str:
+        # Counter samples carry the _total suffix, as prometheus_client writes them
+        return f"{self.name}_total"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.family}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                    for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # Per label set: [count per bucket], sum
+        self._values: Dict[Tuple, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * len(self.buckets), [0.0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            total[0] += value
+
+    def sums(self) -> Dict[Tuple, float]:
+        """Total observed value per label set"""
+        with self._lock:
+            return {key: total[0] for key, (_, total) in self._values.items()}
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    le = f'le="{_format_value(float(bound))}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total[0])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+PHASE_SECONDS = REGISTRY.register(Histogram(
+    'xmplus_sync_phase_seconds', 'Duration of each sync phase',
+    ('phase',)))
+API_REQUESTS = REGISTRY.register(Counter(
+    'xmplus_sync_sui_requests', 's-ui API requests by endpoint and HTTP status (error when no response)',
+    ('endpoint', 'status')))
+ACTIVE_USERS = REGISTRY.register(Gauge(
+    'xmplus_sync_active_users', 'Users eligible in XMPlus and present in s-ui at the last user sync',
+    ('source',)))
+CHARGED_BYTES = REGISTRY.register(Counter(
+    'xmplus_sync_charged_bytes', 'Bytes charged to XMPlus since the process started',
+    ('direction',)))
+PASS_CHARGED_BYTES = REGISTRY.register(Gauge(
+    'xmplus_sync_pass_charged_bytes', 'Bytes charged to XMPlus by the last traffic pass',
+    ('direction',)))
+JOURNAL_HELD = REGISTRY.register(Gauge(
+    'xmplus_sync_journal_held_entries',
+    'Traffic transfers held until resolved with the journal command; their clients are not synced'))
+LAST_SUCCESS = REGISTRY.register(Gauge(
+    'xmplus_sync_last_run_timestamp_seconds', 'Unix time the last sync pass finished'))
+
+
+def record_charged(deltas: Sequence[Tuple[str, int, int]], rowcounts: Dict[str, int]) -> None:
+    """Count the (uuid, u, d) deltas that matched a service row as charged bytes"""
+    up = sum(u for token, u, _ in deltas if rowcounts.get(token))
+    down = sum(d for token, _, d in deltas if rowcounts.get(token))
+    CHARGED_BYTES.inc(up, direction='up')
+    CHARGED_BYTES.inc(down, direction='down')
+    PASS_CHARGED_BYTES.inc(up, direction='up')
+    PASS_CHARGED_BYTES.inc(down, direction='down')
+
+
+def reset_pass_charged() -> None:
+    PASS_CHARGED_BYTES.set(0, direction='up')
+    PASS_CHARGED_BYTES.set(0, direction='down')
+
+
+def phase_timer(phase: str):
+    """Time a block into the phase duration histogram"""
+    return PHASE_SECONDS.time(phase=phase)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port: int, address: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve /metrics from a background thread for the lifetime of the process"""
+    server = ThreadingHTTPServer((address, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info("Serving metrics on http://%s:%s/metrics", address, port)
+    return server
+
+
+def write_textfile(path: str) -> None:
+    """Write the metrics atomically for node_exporter's textfile collector"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(REGISTRY.render())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def metrics_config(config: Dict) -> Tuple[Optional[int], str, Optional[str]]:
+    """(port, address, textfile) from the metrics config section; unset values disable that output"""
+    metrics = config.get('metrics', {})
+    port = metrics.get('port')
+    return (int(port) if port else None,
+            metrics.get('address', '127.0.0.1'),
+            metrics.get('textfile') or None)
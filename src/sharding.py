@@ -0,0 +1,66 @@
+import bisect
+import hashlib
+from typing import Dict, Iterable, Optional
+
+DEFAULT_REPLICAS = 160
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hash ring mapping service uuids to node ids.
+
+    Each node is placed on the ring replicas times, so adding or removing a
+    node only moves the users of the ring segments it takes over or gives up.
+    """
+
+    def __init__(self, nodes: Iterable[str], replicas: int = DEFAULT_REPLICAS):
+        points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        if not points:
+            raise ValueError("Hash ring needs at least one node")
+        self._keys = [key for key, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str) -> str:
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._nodes[index]
+
+
+class NodeShard:
+    """The share of XMPlus services assigned to this node"""
+
+    def __init__(self, node_id: str, ring: HashRing):
+        self.node_id = node_id
+        self.ring = ring
+
+    def owns(self, uuid: str) -> bool:
+        return self.ring.node_for(uuid) == self.node_id
+
+    @classmethod
+    def from_config(cls, config: Dict) -> Optional['NodeShard']:
+        """Build the shard from the node config section, None when sharding is off.
+
+        node.nodes lists every node id (optionally mapped to its server_ip);
+        node.shard_count is a shorthand for numbered nodes 0..shard_count-1.
+        """
+        node_config = config.get('node', {})
+        nodes = node_config.get('nodes') or [str(i) for i in range(int(node_config.get('shard_count', 0)))]
+        if len(nodes) < 2:
+            return None
+
+        node_id = str(node_config.get('id', ''))
+        nodes = [str(node) for node in nodes]
+        if node_id not in nodes:
+            raise ValueError(f"node.id {node_id!r} is not one of node.nodes {nodes}")
+        return cls(node_id, HashRing(nodes, int(node_config.get('replicas', DEFAULT_REPLICAS))))
+
+
+def node_server_ip(config: Dict) -> str:
+    """server_ip of this node: its entry in node.nodes when that is a mapping, else server_ip"""
+    node_config = config.get('node', {})
+    nodes = node_config.get('nodes')
+    if isinstance(nodes, dict) and nodes.get(str(node_config.get('id', ''))):
+        return nodes[str(node_config['id'])]
+    return config['server_ip']
@@ -0,0 +1,180 @@
+import logging
+import random
+import threading
+import time
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from executor import RateLimiter
+from metrics import API_REQUESTS
+
+DEFAULT_BASE_URL = "http://localhost:2095/app/apiv2"
+
+
+class EndpointStats:
+    __slots__ = ('calls', 'errors', 'retries', 'total_seconds', 'max_seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'total_seconds': round(self.total_seconds, 6),
+            'avg_seconds': round(self.total_seconds / self.calls, 6) if self.calls else 0.0,
+            'max_seconds': round(self.max_seconds, 6)
+        }
+
+
+def _not_sent(error: requests.exceptions.RequestException) -> bool:
+    """Whether the request failed while connecting, before any of it reached s-ui"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class SUIClient:
+    """Pooled s-ui apiv2 client with timeouts, bounded retries and latency counters"""
+
+    def __init__(self, api_token: str, base_url: str = DEFAULT_BASE_URL,
+                 connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 retries: int = 3, backoff: float = 0.5, backoff_max: float = 8.0,
+                 pool_size: int = 10, rate_limit: float = 0.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.rate_limiter = RateLimiter(rate_limit)
+
+        self.session = requests.Session()
+        self.session.headers.update({'Token': api_token})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._stats: Dict[str, EndpointStats] = {}
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'SUIClient':
+        api_config = config.get('sui_api', {})
+        return cls(
+            api_token=config['api_token'],
+            base_url=api_config.get('base_url', DEFAULT_BASE_URL),
+            connect_timeout=float(api_config.get('connect_timeout', 5)),
+            read_timeout=float(api_config.get('read_timeout', 30)),
+            retries=int(api_config.get('retries', 3)),
+            backoff=float(api_config.get('backoff', 0.5)),
+            backoff_max=float(api_config.get('backoff_max', 8)),
+            pool_size=int(api_config.get('pool_size', 10)),
+            rate_limit=float(api_config.get('rate_limit', 0))
+        )
+
+    def _record(self, endpoint: str, seconds: float, error: bool, retried: bool,
+                status: str = 'error') -> None:
+        name = endpoint.split('/')[0]
+        API_REQUESTS.inc(endpoint=name, status=status)
+        with self._stats_lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = EndpointStats()
+            stats.calls += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            if error:
+                stats.errors += 1
+            if retried:
+                stats.retries += 1
+
+    def _sleep_before_retry(self, attempt: int) -> None:
+        # Full jitter keeps parallel callers from retrying in lockstep
+        delay = min(self.backoff_max, self.backoff * (2 ** attempt))
+        time.sleep(random.uniform(0, delay))
+
+    def request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+        """Send a request, retrying 5xx responses and connection failures.
+
+        Other methods than GET are only retried when the connection could not
+        be established: once a POST /save is sent, s-ui may have applied it
+        even if the connection drops, times out or a 5xx comes back (a failed
+        core reload after the save, for one).
+        """
+        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        kwargs.setdefault('timeout', self.timeout)
+        idempotent = method.upper() == 'GET'
+
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                retryable = idempotent or _not_sent(e)
+                will_retry = retryable and attempt < self.retries
+                self._record(endpoint, time.monotonic() - started, True, will_retry)
+                if not will_retry:
+                    raise
+                logging.warning("s-ui %s %s failed (%s), retrying", method, endpoint, e)
+            else:
+                failed = response.status_code >= 500
+                will_retry = failed and idempotent and attempt < self.retries
+                self._record(endpoint, time.monotonic() - started, failed, will_retry,
+                             str(response.status_code))
+                if not will_retry:
+                    return response
+                # A streamed response holds its pooled connection until closed
+                response.close()
+                logging.warning("s-ui %s %s returned %s, retrying", method, endpoint, response.status_code)
+
+            self._sleep_before_retry(attempt)
+            attempt += 1
+
+    def get(self, endpoint: str, **kwargs) -> requests.Response:
+        return self.request('GET', endpoint, **kwargs)
+
+    def post(self, endpoint: str, **kwargs) -> requests.Response:
+        return self.request('POST', endpoint, **kwargs)
+
+    def save(self, action: str, data: str, obj: str = 'clients') -> Dict:
+        files = {
+            'object': (None, obj),
+            'action': (None, action),
+            'data': (None, data)
+        }
+        response = self.post('save', files=files)
+        response.raise_for_status()
+        return response.json()
+
+    def latency_stats(self) -> Dict[str, Dict]:
+        with self._stats_lock:
+            return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_shared_clients: Dict[tuple, SUIClient] = {}
+_shared_lock = threading.Lock()
+
+
+def get_sui_client(config: Dict) -> SUIClient:
+    """Return the process-wide SUIClient for this config's base URL and token"""
+    base_url = config.get('sui_api', {}).get('base_url', DEFAULT_BASE_URL)
+    key = (base_url, config['api_token'])
+    with _shared_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            client = _shared_clients[key] = SUIClient.from_config(config)
+        return client
@@ -0,0 +1,60 @@
+import json
+import sqlite3
+from contextlib import closing
+from typing import Dict, List, Optional
+
+from client_index import ClientRecord
+
+JSON_COLUMNS = ('config', 'inbounds', 'links')
+# Columns that are also keys of the client record the API returns and accepts on edit
+CLIENT_FIELDS = ('id', 'enable', 'name', 'config', 'inbounds', 'links', 'volume', 'expiry',
+                 'up', 'down', 'desc', 'group')
+
+
+class SUIDatabaseReader:
+    """Read-only view of the s-ui SQLite database.
+
+    Only used for reads; every write still goes through the s-ui API so the
+    panel reloads its config as usual.
+    """
+
+    def __init__(self, db_path: str, timeout: float = 5.0):
+        self.db_path = db_path
+        self.timeout = timeout
+
+    def _connect(self) -> sqlite3.Connection:
+        # mode=ro never takes a write lock, so s-ui keeps writing through WAL
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=self.timeout)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def list_clients(self) -> List[ClientRecord]:
+        """Return id, name, enable, up and down for every client"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT id, name, enable, up, down FROM clients").fetchall()
+
+        return [ClientRecord(row['id'], row['name'], bool(row['enable']), row['up'] or 0, row['down'] or 0)
+                for row in rows]
+
+    def get_client(self, client_id: int) -> Optional[Dict]:
+        """Return the stored record of one client shaped as the API returns it, or None if it is gone"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM clients WHERE id = ?", (client_id,)).fetchone()
+        if row is None:
+            return None
+
+        columns = row.keys()
+        client = {key: row[key] for key in CLIENT_FIELDS if key in columns}
+        client['enable'] = bool(client.get('enable'))
+        for column in JSON_COLUMNS:
+            value = client.get(column)
+            if isinstance(value, (str, bytes)) and value:
+                client[column] = json.loads(value)
+        return client
+
+
+def get_sui_reader(config: Dict) -> Optional[SUIDatabaseReader]:
+    """Return a SQLite reader when sui_read_backend is "sqlite", otherwise None"""
+    if config.get('sui_read_backend', 'api') != 'sqlite':
+        return None
+    return SUIDatabaseReader(config.get('sui_db_path', '/usr/local/s-ui/db/s-ui.db'))
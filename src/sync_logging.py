@@ -0,0 +1,106 @@
+import datetime
+import json
+import logging
+import os
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Dict
+
+from metrics import PHASE_SECONDS
+
+DEFAULT_LOG_DIR = '/root/xmplus-hysteria2'
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_configured = False
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per line, with fields passed through extra= kept as keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                    .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(config: Dict, filename: str) -> None:
+    """Configure the root logger once per process from the logging config section.
+
+    Writes JSON lines (or text with logging.format = "text") to a size-rotated
+    file in logging.dir, plus plain text to stderr unless logging.console is false.
+    """
+    global _configured
+    if _configured:
+        return
+    _configured = True
+
+    log_config = config.get('logging', {})
+    level = getattr(logging, str(log_config.get('level', 'INFO')).upper(), logging.INFO)
+    root = logging.getLogger()
+    root.setLevel(level)
+    # Process and thread names are never logged, skip looking them up per record
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    if log_config.get('console', True):
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter(TEXT_FORMAT))
+        root.addHandler(console)
+
+    directory = log_config.get('dir', DEFAULT_LOG_DIR)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        handler = RotatingFileHandler(
+            os.path.join(directory, filename),
+            maxBytes=int(log_config.get('max_bytes', 10 * 1024 * 1024)),
+            backupCount=int(log_config.get('backup_count', 5)),
+            encoding='utf-8',
+            delay=True
+        )
+    except OSError as e:
+        logging.error("Cannot open log file in %s, logging to stderr only: %s", directory, e)
+        return
+    if log_config.get('format', 'json') == 'json':
+        handler.setFormatter(JsonLinesFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    root.addHandler(handler)
+
+
+class RunSummary:
+    """Counts and phase timings of one sync run, logged as a single record at the end"""
+
+    def __init__(self, run: str):
+        self.run = run
+        self.counts: Dict[str, object] = {}
+        self._started = time.monotonic()
+        self._phases = PHASE_SECONDS.sums()
+
+    def add(self, **counts) -> None:
+        self.counts.update(counts)
+
+    def emit(self) -> Dict:
+        duration = round(time.monotonic() - self._started, 3)
+        phases = {}
+        for key, total in PHASE_SECONDS.sums().items():
+            spent = total - self._phases.get(key, 0.0)
+            if spent > 0:
+                phases[key[0]] = round(spent, 3)
+        summary = {'run': self.run, 'duration_seconds': duration, 'phases': phases, **self.counts}
+        logging.info("%s finished in %.3fs: %s", self.run, duration,
+                     ', '.join(f"{name}={value}" for name, value in self.counts.items()),
+                     extra={'summary': summary})
+        return summary
@@ -0,0 +1,83 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from xmplus_db import billable_traffic
+
+PLAN_VERSION = 1
+
+
+class SyncPlan:
+    """The user and traffic changes of one full sync, computed without applying them.
+
+    Saved as JSON so the diff can be reviewed and replayed later with
+    `plan --apply`. traffic entries hold the raw s-ui bytes to charge
+    per client together with the counters they were read from.
+    """
+
+    def __init__(self, to_add: List[str], to_remove: List[Dict], traffic: List[Dict],
+                 traffic_mode: str, server_ip: str = '', created_at: Optional[float] = None):
+        self.to_add = to_add
+        self.to_remove = to_remove
+        self.traffic = traffic
+        self.traffic_mode = traffic_mode
+        self.server_ip = server_ip
+        self.created_at = created_at if created_at is not None else time.time()
+
+    def totals(self) -> Dict[str, int]:
+        up = sum(entry['charge_up'] for entry in self.traffic)
+        down = sum(entry['charge_down'] for entry in self.traffic)
+        billable = [billable_traffic(entry['charge_up'], entry['charge_down']) for entry in self.traffic]
+        return {
+            'users_to_add': len(self.to_add),
+            'users_to_remove': len(self.to_remove),
+            'traffic_clients': len(self.traffic),
+            'up_bytes': up,
+            'down_bytes': down,
+            'billable_up_bytes': sum(u for u, _ in billable),
+            'billable_down_bytes': sum(d for _, d in billable)
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': PLAN_VERSION,
+            'created_at': self.created_at,
+            'server_ip': self.server_ip,
+            'traffic_mode': self.traffic_mode,
+            'totals': self.totals(),
+            'to_add': self.to_add,
+            'to_remove': self.to_remove,
+            'traffic': self.traffic
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'SyncPlan':
+        if data.get('version') != PLAN_VERSION:
+            raise ValueError(f"Unsupported plan version: {data.get('version')}")
+        return cls(
+            to_add=data['to_add'],
+            to_remove=data['to_remove'],
+            traffic=data['traffic'],
+            traffic_mode=data['traffic_mode'],
+            server_ip=data.get('server_ip', ''),
+            created_at=data['created_at']
+        )
+
+    def save(self, path: str) -> None:
+        """Write the plan as JSON to path, or to stdout when path is -"""
+        text = json.dumps(self.to_dict(), indent=2)
+        if path == '-':
+            sys.stdout.write(text + '\n')
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.plan-')
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'SyncPlan':
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f))
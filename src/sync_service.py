@@ -0,0 +1,946 @@
+import mysql.connector
+import json
+import requests
+import sqlite3
+import threading
+import logging
+import time
+from contextlib import contextmanager
+from typing import ContextManager, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from async_engine import DEFAULT_CHARGE_CHUNK, run_full_sync
+from bulk_save import save_in_batches
+from change_cursor import ChangeCursor
+from client_index import Client, ClientIndex
+from client_stream import CHUNK_SIZE, parse_clients_response
+from client_template import ClientTemplate, NewClient, batch_payload
+from daemon import SyncDaemon
+from eligibility import EligibilityRules
+from inbounds import InboundMap, discover_inbounds
+from metrics import (ACTIVE_USERS, JOURNAL_HELD, LAST_SUCCESS, metrics_config, phase_timer,
+                     record_charged, reset_pass_charged, serve_metrics, write_textfile)
+from sui_api import get_sui_client
+from sharding import node_server_ip
+from sui_db import get_sui_reader
+from sync_logging import RunSummary, setup_logging
+from sync_plan import SyncPlan
+from traffic_checkpoint import DEFAULT_STATE_PATH, TrafficCheckpoint
+from traffic_journal import (ABORTED, CHARGED, DONE, HELD, PENDING, RESETTING, TrafficJournal,
+                             reset_was_applied)
+from xmplus_db import (apply_traffic_deltas, billable_traffic, committed_batches,
+                       ensure_transfer_table, fetch_active_uuids, fetch_changed_services,
+                       get_service_cursor, get_xmplus_pool, select_eligible_in_memory)
+
+DEFAULT_CONFIG_PATH = '/root/xmplus-hysteria2/config.json'
+
+
+def load_config(path: str = DEFAULT_CONFIG_PATH) -> Dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _has_traffic(client: Dict) -> bool:
+    return bool(client.get('up')) or bool(client.get('down'))
+
+
+class SyncService:
+    """User and traffic sync between XMPlus and one s-ui panel, shared by every entry point"""
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self.db_config = config['database']['xmplus']
+        self.db_pool = get_xmplus_pool(self.db_config)
+        self.server_ip = node_server_ip(config)
+        self.api_token = config['api_token']
+        self.sui = get_sui_client(config)
+        self.sui_db = get_sui_reader(config)
+        self.obfs_password = config['obfs_password']
+        self.rules = EligibilityRules.from_config(config)
+        self.discover_inbounds = bool(config.get('node', {}).get('discover_inbounds', False))
+
+        sync_config = config.get('sync', {})
+        self.batch_size = int(sync_config.get('batch_size', 0))
+        self.bulk_add_action = sync_config.get('bulk_add_action', 'new')
+        self.bulk_del_action = sync_config.get('bulk_del_action', 'del')
+        self.concurrency = int(sync_config.get('concurrency', 1))
+        self.incremental_users = bool(sync_config.get('incremental_users', False))
+        self.cursor_column = sync_config.get('cursor_column', 'updated_at')
+        self.full_reconcile_interval = float(sync_config.get('full_reconcile_interval', 3600))
+        self.engine = sync_config.get('engine', 'sync')
+        self.charge_chunk_size = int(sync_config.get('charge_chunk_size', DEFAULT_CHARGE_CHUNK))
+
+        self.traffic_mode = sync_config.get('traffic_mode', 'reset')
+        self.reset_threshold = int(sync_config.get('reset_threshold', 10 * 1024 ** 3))
+        self.state_path = sync_config.get('state_path', DEFAULT_STATE_PATH)
+        self.metrics_port, self.metrics_address, self.metrics_textfile = metrics_config(config)
+
+        self._client_index: Optional[ClientIndex] = None
+        self._index_lock = threading.Lock()
+        self._client_template: Optional[ClientTemplate] = None
+        # Set while one /clients snapshot serves every read of a pass
+        self._snapshot_pinned = False
+        self._checkpoint: Optional[TrafficCheckpoint] = None
+        self._change_cursor: Optional[ChangeCursor] = None
+        self._journal: Optional[TrafficJournal] = None
+        self._setup_logging()
+
+    def _setup_logging(self) -> None:
+        setup_logging(self.config, 'sync.log')
+
+    def _connect_xmplus(self) -> ContextManager:
+        return self.db_pool.connection()
+
+    def _post_save(self, action: str, data: str) -> Dict:
+        return self.sui.save(action, data)
+
+    def _get_client_template(self) -> ClientTemplate:
+        """Template for new clients, built on first use from node.inbounds or the s-ui inbounds"""
+        if self._client_template is None:
+            discovered = discover_inbounds(self.sui) if self.discover_inbounds else None
+            if self.discover_inbounds and not discovered:
+                logging.warning("No hysteria2 inbounds discovered in s-ui, using node.inbounds")
+            inbound_map = InboundMap.from_config(self.config, discovered)
+            self._client_template = ClientTemplate.from_config(self.config, self.server_ip, inbound_map)
+        return self._client_template
+
+    def _add_user(self, username: str, token: str) -> bool:
+        index = self._get_client_index()
+        if index is None or username in index:
+            return False
+
+        return self._save_new_client(self._get_client_template().build([(username, token)])[0])
+
+    def _save_new_client(self, client: NewClient) -> bool:
+        username = client.name
+        try:
+            result = self._post_save('new', client.payload)
+
+            if result.get('success'):
+                self._index_add([client])
+                return True
+            else:
+                logging.warning("Failed to add user %s: %s", username, result.get('msg'))
+                return False
+        except Exception as e:
+            logging.error("Error adding user %s: %s", username, e)
+            return False
+
+    def _save_new_clients_batch(self, clients: List[NewClient]) -> Optional[bool]:
+        """Add clients in one save; None when s-ui may have applied part of it"""
+        try:
+            result = self._post_save(self.bulk_add_action, batch_payload(clients))
+        except Exception as e:
+            # Sending them again could create duplicates; the next pass adds whatever is missing
+            logging.error("Error adding batch of %s users, leaving them to the next pass: %s", len(clients), e)
+            self._reload_client_index()
+            return None
+
+        if not result.get('success'):
+            logging.warning("Batch of %s users rejected, retrying one by one: %s", len(clients), result.get('msg'))
+            return False
+
+        self._index_add(clients)
+        return True
+
+    def _index_add(self, clients: List[NewClient]) -> None:
+        index = self._get_client_index()
+        if index is not None:
+            for client in clients:
+                index.add(client.record())
+
+    def _add_users(self, usernames: List[str]) -> int:
+        index = self._get_client_index()
+        if index is None:
+            # Without the current list every user would look new
+            logging.error("Cannot read s-ui clients, not adding %s users", len(usernames))
+            return 0
+        clients = self._get_client_template().build(
+            (username, username) for username in usernames if username not in index)
+        with phase_timer('add'):
+            saved = save_in_batches(clients, self.batch_size,
+                                    self._save_new_clients_batch, self._save_new_client,
+                                    concurrency=self.concurrency)
+        return len(saved)
+
+    def _get_client_index(self, refresh: bool = False) -> Optional[ClientIndex]:
+        """Return the per-run client index, fetching /clients only when needed.
+
+        None when s-ui could not be read; a failed read is never taken for an
+        empty panel, and the stale index is dropped with it.
+        """
+        with self._index_lock:
+            if self._client_index is None or (refresh and not self._snapshot_pinned):
+                self._load_client_index()
+            return self._client_index
+
+    def _reload_client_index(self) -> None:
+        """Replace the index, even a pinned snapshot, with what s-ui holds now"""
+        with self._index_lock:
+            self._load_client_index()
+
+    def _load_client_index(self) -> None:
+        with phase_timer('client_fetch'):
+            clients = self._fetch_clients()
+        self._client_index = ClientIndex(clients) if clients is not None else None
+
+    def _get_user_id(self, username: str) -> Optional[int]:
+        index = self._get_client_index()
+        if index is not None and username in index and index.get_id(username) is None:
+            # Added during this run; s-ui assigns the id, so look it up once
+            index = self._get_client_index(refresh=True)
+        return index.get_id(username) if index is not None else None
+
+    def _remove_user(self, username: str) -> bool:
+        user_id = self._get_user_id(username)
+        if user_id is None:
+            return False
+
+        try:
+            result = self._post_save('del', str(user_id))
+
+            if result.get('success'):
+                self._index_remove([username])
+                return True
+            else:
+                return False
+        except Exception as e:
+            return False
+
+    def _remove_users_batch(self, usernames: List[str]) -> bool:
+        user_ids = [self._get_user_id(username) for username in usernames]
+        if any(user_id is None for user_id in user_ids):
+            return False
+
+        try:
+            result = self._post_save(self.bulk_del_action, json.dumps(user_ids))
+        except Exception as e:
+            logging.error("Error removing batch of %s users: %s", len(usernames), e)
+            return False
+
+        if not result.get('success'):
+            logging.warning("Batch of %s removals rejected, retrying one by one: %s", len(usernames), result.get('msg'))
+            return False
+
+        self._index_remove(usernames)
+        return True
+
+    def _index_remove(self, usernames: List[str]) -> None:
+        index = self._get_client_index()
+        if index is not None:
+            for username in usernames:
+                index.remove(username)
+
+    def _remove_users(self, usernames: List[str]) -> int:
+        with phase_timer('remove'):
+            saved = save_in_batches(usernames, self.batch_size,
+                                    self._remove_users_batch, self._remove_user,
+                                    concurrency=self.concurrency)
+        return len(saved)
+
+    def _read_clients_from_db(self) -> Optional[List[Client]]:
+        """Compact client rows from the s-ui SQLite file, or None to use the API"""
+        if self.sui_db is None:
+            return None
+        try:
+            return self.sui_db.list_clients()
+        except sqlite3.Error as e:
+            logging.error("Error reading s-ui database, falling back to API: %s", e)
+            return None
+
+    def _fetch_clients(self) -> Optional[List[Client]]:
+        """All s-ui clients, or None when they could not be read"""
+        clients = self._read_clients_from_db()
+        if clients is not None:
+            return clients
+
+        try:
+            # Streamed, so only compact records are held; in reset mode clients with
+            # traffic stay whole, as the reset has to send their record back
+            keep_full = _has_traffic if self.traffic_mode == 'reset' else None
+            with self.sui.get('clients', stream=True) as response:
+                response.raise_for_status()
+                success, msg, clients = parse_clients_response(response.iter_content(CHUNK_SIZE), keep_full)
+
+            if not success:
+                logging.error("API returned error: %s", msg)
+                return None
+
+            return clients
+
+        except requests.exceptions.RequestException as e:
+            logging.error("Error getting s-ui clients: %s", e)
+            return None
+        except ValueError as e:
+            logging.error("Invalid /clients response: %s", e)
+            return None
+        except Exception as e:
+            logging.exception("Unexpected error reading s-ui clients: %s", e)
+            return None
+
+    def _shared_client_snapshot(self) -> ContextManager:
+        """Serve every client list read inside the block from one /clients snapshot.
+
+        Traffic resets and user changes update the snapshot as they are applied.
+        If the fetch fails each phase reads s-ui on its own as before.
+        """
+        with phase_timer('client_fetch'):
+            clients = self._fetch_clients()
+        return self._pinned_clients(clients)
+
+    @contextmanager
+    def _pinned_clients(self, clients: Optional[List[Client]]) -> Iterator[None]:
+        """Pin an already fetched client list as the snapshot; None leaves reads unpinned"""
+        if clients is None:
+            yield
+            return
+
+        with self._index_lock:
+            self._client_index = ClientIndex(clients)
+            self._snapshot_pinned = True
+        try:
+            yield
+        finally:
+            self._snapshot_pinned = False
+
+    def _get_change_cursor(self) -> ChangeCursor:
+        if self._change_cursor is None:
+            self._change_cursor = ChangeCursor(self.state_path)
+        return self._change_cursor
+
+    def _sync_users_incremental(self) -> Tuple[int, int]:
+        """Apply only the services changed since the stored cursor"""
+        change_cursor = self._get_change_cursor()
+        with phase_timer('db_query'), self._connect_xmplus() as conn:
+            rows = fetch_changed_services(conn, self.cursor_column, change_cursor.value,
+                                          self.rules.columns())
+        if not rows:
+            return 0, 0
+
+        index = self._get_client_index(refresh=True)
+        if index is None:
+            # Keep the cursor so these rows are applied once s-ui can be read
+            logging.error("Cannot read s-ui clients, skipping %s changed services", len(rows))
+            return 0, 0
+        to_add = {}
+        to_remove = set()
+        for row in rows:
+            if self.rules.matches(row):
+                if row['uuid'] not in index:
+                    to_add[row['uuid']] = row['id']
+            elif row['uuid'] in index:
+                to_remove.add(row['uuid'])
+
+        room = self.rules.room(len(index) - len(to_remove))
+        if room is not None and len(to_add) > room:
+            # Oldest services first, as in the full query; the rest wait for the next full reconcile
+            to_add = dict(sorted(to_add.items(), key=lambda item: item[1])[:room])
+
+        removed_count = self._remove_users(sorted(to_remove))
+        added_count = self._add_users(sorted(to_add))
+        self._report_sui_users()
+
+        # Keep the old cursor after a failure so the same rows are retried next run
+        if removed_count == len(to_remove) and added_count == len(to_add):
+            change_cursor.advance(max(row['change_cursor'] for row in rows))
+        return added_count, removed_count
+
+    def sync_users(self) -> tuple[int, int]:
+        try:
+            if self._wants_incremental_users():
+                return self._sync_users_incremental()
+
+            return self._apply_user_diff(*self._query_active_users())
+
+        except Exception as e:
+            logging.exception("Error in sync_users: %s", e)
+            return 0, 0
+
+    def _wants_incremental_users(self) -> bool:
+        return (self.incremental_users and
+                not self._get_change_cursor().needs_full_sync(self.full_reconcile_interval))
+
+    def _query_active_users(self) -> Tuple[set, Optional[object]]:
+        """Active UUIDs from xmplus, with the change cursor value read just before them"""
+        with phase_timer('db_query'), self._connect_xmplus() as conn:
+            # Read the cursor first so rows changed during this run are seen again
+            change_value = get_service_cursor(conn, self.cursor_column) if self.incremental_users else None
+            active_uuids = fetch_active_uuids(conn, self.rules)
+        ACTIVE_USERS.set(len(active_uuids), source='xmplus')
+        return active_uuids, change_value
+
+    def _report_sui_users(self) -> None:
+        index = self._get_client_index()
+        if index is not None:
+            ACTIVE_USERS.set(len(index), source='sui')
+
+    def _apply_user_diff(self, active_uuids: set, change_value) -> Tuple[int, int]:
+        # Get current users from s-ui (one snapshot for the whole run)
+        index = self._get_client_index(refresh=True)
+        if index is None:
+            logging.error("Cannot read s-ui clients, skipping user sync")
+            return 0, 0
+        current_uuids = index.names()
+
+        # Users to remove and add
+        to_remove = current_uuids - active_uuids
+        to_add = active_uuids - current_uuids
+
+        # Remove inactive users
+        removed_count = self._remove_users(sorted(to_remove))
+
+        # Add new users
+        added_count = self._add_users(sorted(to_add))
+
+        self._report_sui_users()
+
+        if self.incremental_users and removed_count == len(to_remove) and added_count == len(to_add):
+            self._get_change_cursor().mark_full_sync(change_value)
+
+        return added_count, removed_count
+
+    def preview_users(self) -> Tuple[set, set]:
+        """Services the rules would add and remove, evaluated in memory without writing anything"""
+        with self._connect_xmplus() as conn:
+            eligible = select_eligible_in_memory(conn, self.rules)
+        index = self._get_client_index(refresh=True)
+        if index is None:
+            raise RuntimeError("Cannot read s-ui clients")
+        current = index.names()
+        return eligible - current, current - eligible
+
+    # Traffic sync methods
+    def _get_traffic_data(self) -> List[Client]:
+        if self._snapshot_pinned:
+            clients = self._client_index.clients()
+        else:
+            with phase_timer('client_fetch'):
+                clients = self._fetch_clients()
+
+        if not clients:
+            return []
+
+        # Filter clients with traffic
+        filtered_clients = []
+        for client in clients:
+            if client.get('down', 0) > 0 or client.get('up', 0) > 0:
+                filtered_clients.append(client)
+
+        return filtered_clients
+
+    def _fetch_client(self, client_id: int) -> Optional[Dict]:
+        """The full stored record of one client from the API, or None if it is gone"""
+        response = self.sui.get(f'client/{client_id}')
+        response.raise_for_status()
+        data = response.json()
+        if not data.get('success'):
+            return None
+        return data.get('obj')
+
+    def _stored_client(self, client_data: Client) -> Optional[Dict]:
+        """The record s-ui holds for a client, config and credentials included"""
+        if 'config' in client_data:
+            return client_data
+
+        # Compact records (both read backends) lack the fields the edit call must send back
+        if self._client_index is not None:
+            cached = self._client_index.get(client_data['name'])
+            if cached is not None and 'config' in cached and cached.get('id') == client_data['id']:
+                return cached
+        if self.sui_db is not None:
+            return self.sui_db.get_client(client_data['id'])
+        return self._fetch_client(client_data['id'])
+
+    def _reset_traffic(self, client_data: Client, up: int = 0, down: int = 0) -> bool:
+        """Reset traffic for a specific client using API, leaving up/down bytes on the counters"""
+        return bool(self._send_reset(client_data, up, down))
+
+    def _send_reset(self, client_data: Client, up: int = 0, down: int = 0) -> Optional[bool]:
+        """Reset a client's counters to up/down; None when s-ui may or may not have applied it.
+
+        s-ui replaces the whole client on edit, so the stored record is sent back
+        unchanged apart from the counters, including fields this sync does not know.
+        """
+        try:
+            stored = self._stored_client(client_data)
+        except (sqlite3.Error, requests.exceptions.RequestException, ValueError) as e:
+            logging.error("Error reading client %s from s-ui: %s", client_data['name'], e)
+            return False
+        if stored is None:
+            logging.error("Client %s no longer exists in s-ui", client_data['name'])
+            return False
+
+        reset_data = dict(stored, up=up, down=down)
+
+        try:
+            result = self._post_save('edit', json.dumps(reset_data))
+
+            if result.get('success'):
+                logging.debug("Reset traffic for client %s", client_data['name'])
+                self._record_reset(client_data['name'], up, down)
+                return True
+            else:
+                logging.error("Failed to reset traffic for client %s: %s", client_data['name'], result.get('msg'))
+                return False
+
+        except (requests.exceptions.RequestException, ValueError) as e:
+            # The edit may have been applied before the reply was lost
+            logging.error("Error resetting traffic for client %s: %s", client_data['name'], e)
+            applied = self._read_back_reset(client_data)
+            if applied:
+                self._record_reset(client_data['name'], up, down)
+            return applied
+
+    def _read_back_reset(self, client_data: Client) -> Optional[bool]:
+        """Whether an edit whose reply was lost reset the counters, judged from client/<id> right away.
+
+        Read before new usage can blur the counters, so only None when the
+        client cannot be read.
+        """
+        try:
+            live = self._fetch_client(client_data['id'])
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logging.error("Cannot read back client %s after its reset: %s", client_data['name'], e)
+            return None
+        # A client removed meanwhile has no counters left to reset
+        applied = live is None or reset_was_applied(client_data, live) is True
+        logging.info("Reset of client %s %s", client_data['name'],
+                     "went through" if applied else "did not reach s-ui")
+        return applied
+
+    def _reset_journaled(self, client_data: Client, entry_id: int, up: int = 0, down: int = 0) -> bool:
+        """Reset a charged client, journaling the attempt before it is sent and the result right after"""
+        journal = self._get_journal()
+        journal.mark([entry_id], RESETTING)
+        applied = self._send_reset(client_data, up, down)
+        if applied:
+            journal.mark([entry_id], DONE)
+        elif applied is False:
+            # Nothing reached s-ui, so the next pass may reset it without guessing
+            journal.mark([entry_id], CHARGED)
+        return bool(applied)
+
+    def _record_reset(self, name: str, up: int, down: int) -> None:
+        """Keep the cached client list in step with counters just written to s-ui"""
+        if self._client_index is None:
+            return
+        client = self._client_index.get(name)
+        if client is not None:
+            client['up'] = up
+            client['down'] = down
+
+    def _update_xmplus_traffic_bulk(self, usage: List[Tuple[str, int, int]],
+                                    batch: str) -> Optional[Dict[str, int]]:
+        """Charge (uuid, up, down) usage to XMPlus in one transaction, returning rowcounts per uuid.
+
+        Returns None when the transaction failed in a way that may have left it
+        committed, such as a reply lost after COMMIT; the batch id it recorded
+        settles that on the next pass. Raises RuntimeError, before charging
+        anything, when the sync_transfer table is missing and cannot be created.
+        """
+        deltas = [(token, *billable_traffic(up, down)) for token, up, down in usage]
+
+        try:
+            with phase_timer('traffic_write'), self._connect_xmplus() as conn:
+                try:
+                    ensure_transfer_table(conn)
+                except mysql.connector.Error as e:
+                    # Charging without it could bill a lost COMMIT twice, and skipping quietly bills nothing
+                    raise RuntimeError(f"Cannot create the sync_transfer table, run sql/sync_transfer.sql: {e}") from e
+                rowcounts = apply_traffic_deltas(conn, deltas, batch)
+        except mysql.connector.Error as e:
+            logging.error("Error updating traffic for %s clients: %s", len(deltas), e)
+            return None
+
+        record_charged(deltas, rowcounts)
+        return rowcounts
+
+    def _charge_journaled(self, entry_ids: Dict[str, int],
+                          usage: List[Tuple[str, int, int]]) -> Optional[Dict[str, int]]:
+        """Charge usage for journaled transfers and record the outcome of each.
+
+        Returns rowcounts per uuid, or None when it is unknown whether the
+        charge committed; those entries then stay pending for the next pass.
+        """
+        journal = self._get_journal()
+        batch = journal.assign_batch([entry_ids[token] for token, _, _ in usage])
+        try:
+            rowcounts = self._update_xmplus_traffic_bulk(usage, batch)
+        except RuntimeError:
+            # Nothing was charged, and the run fails instead of leaving the traffic unbilled
+            journal.mark([entry_ids[token] for token, _, _ in usage], ABORTED)
+            raise
+        if rowcounts is None:
+            logging.error("Traffic charge of %s clients may have committed, checking it next pass", len(usage))
+            return None
+        journal.mark([entry_ids[token] for token, _, _ in usage if rowcounts.get(token)], CHARGED)
+        journal.mark([entry_ids[token] for token, _, _ in usage if not rowcounts.get(token)], ABORTED)
+        return rowcounts
+
+    def _committed_batches(self, batches: Iterable[str]) -> Set[str]:
+        with phase_timer('db_query'), self._connect_xmplus() as conn:
+            return committed_batches(conn, batches)
+
+    def _get_journal(self) -> TrafficJournal:
+        if self._journal is None:
+            self._journal = TrafficJournal(self.state_path)
+        return self._journal
+
+    def _recover_traffic_journal(self) -> set:
+        """Resolve transfers a crash left half-done; returns names that are still unresolved"""
+        journal = self._get_journal()
+        entries = journal.unfinished()
+        if not entries:
+            JOURNAL_HELD.set(0)
+            return set()
+
+        done = []
+        held = [entry for entry in entries if entry['state'] == HELD]
+        unresolved = {entry['name'] for entry in held}
+
+        # Charges never confirmed: the sync_transfer ledger tells whether their transaction committed
+        pending = [entry for entry in entries if entry['state'] == PENDING]
+        sent = [entry for entry in pending if entry['batch']]
+        try:
+            committed = self._committed_batches({entry['batch'] for entry in sent})
+        except mysql.connector.Error as e:
+            logging.error("Cannot check %s unconfirmed traffic charges in XMPlus: %s", len(sent), e)
+            unresolved.update(entry['name'] for entry in sent)
+            sent = []
+            committed = set()
+        confirmed = [entry for entry in sent if entry['batch'] in committed]
+        journal.mark([entry['id'] for entry in confirmed], CHARGED)
+        for entry in confirmed:
+            entry['state'] = CHARGED
+        # Never committed: the counters were not reset, so this pass charges them
+        journal.mark([entry['id'] for entry in pending
+                      if entry['state'] == PENDING and entry['name'] not in unresolved], ABORTED)
+
+        charged = [entry for entry in entries if entry['state'] in (CHARGED, RESETTING)]
+        delta_entries = [entry for entry in charged if entry['mode'] == 'delta']
+        reset_entries = [entry for entry in charged if entry['mode'] != 'delta']
+
+        # Delta transfers only need the checkpoint moved to the charged counters
+        if delta_entries:
+            self._get_checkpoint().record(
+                [(entry['name'], entry['client_id'], entry['up'], entry['down']) for entry in delta_entries])
+            done.extend(entry['id'] for entry in delta_entries)
+
+        if reset_entries:
+            current = {client['name']: client for client in self._get_traffic_data()}
+            for entry in reset_entries:
+                client = current.get(entry['name'])
+                if not current:
+                    # No snapshot to compare against, try again next pass
+                    unresolved.add(entry['name'])
+                    continue
+                applied = reset_was_applied(entry, client) if client is not None else True
+                if applied:
+                    done.append(entry['id'])
+                elif applied is None and entry['state'] == RESETTING:
+                    # Subtracting now could take already charged bytes off new usage
+                    logging.error("Cannot tell whether the reset of %s reached s-ui: counters %s/%s are past "
+                                  "the journaled %s/%s; holding journal entry %s until it is resolved "
+                                  "with the journal command",
+                                  entry['name'], client.get('up', 0), client.get('down', 0),
+                                  entry['up'], entry['down'], entry['id'])
+                    held.append(entry)
+                    journal.mark([entry['id']], HELD)
+                    unresolved.add(entry['name'])
+                # Only the bytes already charged are taken off the counters
+                elif not self._reset_journaled(client, entry['id'],
+                                               up=client.get('up', 0) - entry['up'],
+                                               down=client.get('down', 0) - entry['down']):
+                    unresolved.add(entry['name'])
+
+        journal.mark(done, DONE)
+        JOURNAL_HELD.set(len(held))
+        if unresolved:
+            logging.error("%s charged transfers still wait for an s-ui reset", len(unresolved))
+        return unresolved
+
+    def held_transfers(self, include_unfinished: bool = False) -> List[Dict]:
+        """Journal entries whose clients traffic passes skip; with include_unfinished every open entry"""
+        journal = self._get_journal()
+        if include_unfinished:
+            return journal.unfinished()
+        return journal.entries([HELD])
+
+    def resolve_held_transfer(self, entry_id: int, applied: bool) -> None:
+        """Settle a held transfer once its s-ui reset is known to have gone through or not"""
+        if not self._get_journal().resolve_held(entry_id, applied):
+            raise ValueError(f"No held journal entry {entry_id}")
+        logging.info("Journal entry %s resolved: reset %s", entry_id,
+                     "went through" if applied else "did not reach s-ui")
+
+    def _get_checkpoint(self) -> TrafficCheckpoint:
+        if self._checkpoint is None:
+            self._checkpoint = TrafficCheckpoint(self.state_path)
+        return self._checkpoint
+
+    def _sync_traffic_delta(self, unresolved: set) -> int:
+        """Charge XMPlus only the growth since the last pass and reset s-ui counters rarely"""
+        traffic_data = self._get_traffic_data()
+        if not traffic_data:
+            return 0
+
+        checkpoint = self._get_checkpoint()
+        journal = self._get_journal()
+        deltas = [(client, up, down) for client, up, down in checkpoint.deltas(traffic_data)
+                  if client['name'] not in unresolved]
+        entry_ids = journal.begin('delta', [
+            (client['name'], client.get('id'), client.get('up', 0), client.get('down', 0), up, down)
+            for client, up, down in deltas])
+        rowcounts = {}
+        if deltas:
+            rowcounts = self._charge_journaled(
+                entry_ids, [(client['name'], up, down) for client, up, down in deltas]) or {}
+
+        charged = []
+        pending = set()
+        for client, up, down in deltas:
+            if rowcounts.get(client['name']):
+                logging.debug("Charged %s: UP=%s, DOWN=%s", client['name'], up, down)
+                charged.append((client['name'], client.get('id'), client.get('up', 0), client.get('down', 0)))
+            else:
+                logging.error("Failed to update traffic in XMPlus for %s", client['name'])
+                pending.add(client['name'])
+        checkpoint.record(charged)
+        journal.mark([entry_ids[name] for name, _, _, _ in charged], DONE)
+
+        # Counters are reset only once they pass the threshold and are fully charged
+        reset = []
+        with phase_timer('reset'):
+            for client in traffic_data:
+                if client['name'] in pending or client['name'] in unresolved:
+                    continue
+                if client.get('up', 0) + client.get('down', 0) < self.reset_threshold:
+                    continue
+                if self._reset_traffic(client):
+                    reset.append((client['name'], client.get('id'), 0, 0))
+                else:
+                    logging.error("Failed to reset traffic in s-ui for %s", client['name'])
+        checkpoint.record(reset)
+
+        checkpoint.retain(client['name'] for client in traffic_data)
+        journal.purge()
+        return len(charged)
+
+    def sync_traffic(self) -> int:
+        logging.info("Starting traffic synchronization")
+        reset_pass_charged()
+        unresolved = self._recover_traffic_journal()
+        if self.traffic_mode == 'delta':
+            return self._sync_traffic_delta(unresolved)
+
+        traffic_data = [client for client in self._get_traffic_data()
+                        if (client.get('down', 0) > 0 or client.get('up', 0) > 0)
+                        and client['name'] not in unresolved]
+        if not traffic_data:
+            logging.info("No clients with traffic")
+            return 0
+
+        # Journal every transfer before it is applied
+        journal = self._get_journal()
+        entry_ids = journal.begin('reset', [
+            (client['name'], client.get('id'), client.get('up', 0), client.get('down', 0),
+             client.get('up', 0), client.get('down', 0))
+            for client in traffic_data])
+
+        # First update in xmplus, all clients in one transaction
+        rowcounts = self._charge_journaled(
+            entry_ids, [(client['name'], client.get('up', 0), client.get('down', 0)) for client in traffic_data])
+        if rowcounts is None:
+            return 0
+        updated_count = 0
+
+        with phase_timer('reset'):
+            for client in traffic_data:
+                token = client['name']
+                if not rowcounts.get(token):
+                    logging.error("Failed to update traffic in XMPlus for %s", token)
+                    continue
+
+                logging.debug("Processing %s: UP=%s, DOWN=%s", token, client.get('up', 0), client.get('down', 0))
+                try:
+                    # If successful, reset in s-ui
+                    if self._reset_journaled(client, entry_ids[token]):
+                        updated_count += 1
+                        logging.debug("Successfully updated and reset traffic for %s", token)
+                    else:
+                        logging.error("Failed to reset traffic in s-ui for %s", token)
+                except Exception as e:
+                    logging.error("Error processing %s: %s", token, e)
+                    continue
+
+        journal.purge()
+        return updated_count
+
+    def full_sync(self) -> Dict[str, int]:
+        """Perform complete synchronization: traffic first, then users"""
+        summary = RunSummary('full_sync')
+        logging.info("Starting synchronization...")
+
+        if self.engine == 'async':
+            # Same steps, with the XMPlus and s-ui I/O of the pass overlapped
+            results = run_full_sync(self, self.charge_chunk_size)
+        else:
+            # Both steps work from one /clients snapshot
+            with self._shared_client_snapshot():
+                # Step 1: Sync traffic
+                logging.info("Syncing traffic...")
+                traffic_updated = self.sync_traffic()
+
+                # Step 2: Sync users
+                logging.info("Syncing users...")
+                users_added, users_removed = self.sync_users()
+
+            # Summary report
+            results = {
+                'traffic_updated': traffic_updated,
+                'users_added': users_added,
+                'users_removed': users_removed
+            }
+
+        LAST_SUCCESS.set(time.time())
+        summary.add(**results, sui_latency=self.sui.latency_stats())
+        summary.emit()
+        return results
+
+    def build_plan(self) -> SyncPlan:
+        """Compute what full_sync would change from one snapshot of each side, without applying it"""
+        with phase_timer('client_fetch'):
+            clients = self._fetch_clients()
+        if clients is None:
+            raise RuntimeError("Cannot read s-ui clients")
+        index = ClientIndex(clients)
+        with phase_timer('db_query'), self._connect_xmplus() as conn:
+            eligible = select_eligible_in_memory(conn, self.rules)
+        current = index.names()
+
+        with_traffic = [client for client in index if client.get('up', 0) > 0 or client.get('down', 0) > 0]
+        if self.traffic_mode == 'delta':
+            seen = self._get_checkpoint().load()
+            deltas = self._get_checkpoint().deltas(with_traffic)
+        else:
+            seen = {}
+            deltas = [(client, client.get('up', 0), client.get('down', 0)) for client in with_traffic]
+
+        return SyncPlan(
+            to_add=sorted(eligible - current),
+            to_remove=[{'name': name, 'id': index.get_id(name)} for name in sorted(current - eligible)],
+            traffic=[{
+                'name': client['name'],
+                'id': client.get('id'),
+                'up': client.get('up', 0),
+                'down': client.get('down', 0),
+                'charge_up': up,
+                'charge_down': down,
+                # The checkpoint the delta was taken against, to detect passes run after the plan
+                'checkpoint': list(seen[client['name']]) if client['name'] in seen else None
+            } for client, up, down in deltas],
+            traffic_mode=self.traffic_mode,
+            server_ip=self.server_ip
+        )
+
+    def _plan_traffic_entries(self, plan: SyncPlan, unresolved: set) -> List[Tuple[Dict, Dict]]:
+        """(plan entry, live client) pairs that can still be charged exactly as planned"""
+        live = {client['name']: client for client in self._get_traffic_data()}
+        seen = self._get_checkpoint().load() if plan.traffic_mode == 'delta' else {}
+
+        entries = []
+        for entry in plan.traffic:
+            client = live.get(entry['name'])
+            if entry['name'] in unresolved or client is None or client.get('id') != entry['id']:
+                continue
+            if plan.traffic_mode == 'delta':
+                # Another pass moved the checkpoint, so part of this delta is already charged
+                checkpoint = list(seen[entry['name']]) if entry['name'] in seen else None
+                if checkpoint != entry['checkpoint']:
+                    continue
+            elif client.get('up', 0) < entry['charge_up'] or client.get('down', 0) < entry['charge_down']:
+                # Counters were reset since the plan was made, so they were charged elsewhere
+                continue
+            entries.append((entry, client))
+        return entries
+
+    def apply_plan(self, plan: SyncPlan) -> Dict[str, int]:
+        """Replay a saved plan: charge its traffic, then remove and add its users"""
+        if plan.traffic_mode != self.traffic_mode:
+            raise ValueError(f"Plan was made for traffic_mode {plan.traffic_mode}, "
+                             f"config has {self.traffic_mode}")
+        summary = RunSummary('apply_plan')
+        reset_pass_charged()
+        unresolved = self._recover_traffic_journal()
+        entries = self._plan_traffic_entries(plan, unresolved)
+
+        journal = self._get_journal()
+        entry_ids = journal.begin(plan.traffic_mode, [
+            (entry['name'], entry['id'], entry['up'], entry['down'], entry['charge_up'], entry['charge_down'])
+            for entry, _ in entries])
+        rowcounts = {}
+        if entries:
+            rowcounts = self._charge_journaled(
+                entry_ids, [(entry['name'], entry['charge_up'], entry['charge_down']) for entry, _ in entries]) or {}
+        charged = [(entry, client) for entry, client in entries if rowcounts.get(entry['name'])]
+
+        done = []
+        if plan.traffic_mode == 'delta':
+            self._get_checkpoint().record(
+                [(entry['name'], entry['id'], entry['up'], entry['down']) for entry, _ in charged])
+            done = [entry_ids[entry['name']] for entry, _ in charged]
+        else:
+            with phase_timer('reset'):
+                for entry, client in charged:
+                    # Only the planned bytes come off, usage since the plan stays on the counters
+                    if self._reset_journaled(client, entry_ids[entry['name']],
+                                             up=client.get('up', 0) - entry['charge_up'],
+                                             down=client.get('down', 0) - entry['charge_down']):
+                        done.append(entry_ids[entry['name']])
+                    else:
+                        logging.error("Failed to reset traffic in s-ui for %s", entry['name'])
+        journal.mark(done, DONE)
+        journal.purge()
+
+        users_removed = users_added = 0
+        if self._get_client_index(refresh=True) is None:
+            logging.error("Cannot read s-ui clients, skipping the user changes of the plan")
+        else:
+            users_removed = self._remove_users([entry['name'] for entry in plan.to_remove])
+            users_added = self._add_users(plan.to_add)
+        self._report_sui_users()
+
+        results = {
+            'traffic_updated': len(done),
+            'traffic_skipped': len(plan.traffic) - len(entries),
+            'users_added': users_added,
+            'users_removed': users_removed
+        }
+        LAST_SUCCESS.set(time.time())
+        summary.add(**results)
+        summary.emit()
+        return results
+
+    def write_metrics(self) -> None:
+        """Write the metrics textfile for node_exporter, when metrics.textfile is set"""
+        if not self.metrics_textfile:
+            return
+        try:
+            write_textfile(self.metrics_textfile)
+        except OSError as e:
+            logging.error("Error writing metrics to %s: %s", self.metrics_textfile, e)
+
+    def run_daemon(self) -> None:
+        """Run full_sync every sync.interval seconds, reusing the HTTP session and DB pool"""
+        if self.metrics_port:
+            serve_metrics(self.metrics_port, self.metrics_address)
+        SyncDaemon.from_config(self.full_sync, self.config, on_stop=self.close).run()
+
+    def close(self) -> None:
+        self.sui.close()
+        self.db_pool.close()
+        if self._checkpoint is not None:
+            self._checkpoint.close()
+        if self._journal is not None:
+            self._journal.close()
+        if self._change_cursor is not None:
+            self._change_cursor.close()
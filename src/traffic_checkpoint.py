@@ -0,0 +1,84 @@
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+DEFAULT_STATE_PATH = '/root/xmplus-hysteria2/sync_state.db'
+
+
+class TrafficCheckpoint:
+    """Last-seen s-ui up/down counters per client, persisted in a local SQLite file.
+
+    XMPlus is charged only the difference between the live counters and the
+    checkpoint, so s-ui counters do not need to be reset after every pass.
+    A counter lower than its checkpoint (reset in the panel, client recreated
+    under a new id) is charged from zero.
+    """
+
+    def __init__(self, path: str = DEFAULT_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS traffic_checkpoint (
+                name TEXT PRIMARY KEY,
+                client_id INTEGER,
+                up INTEGER NOT NULL,
+                down INTEGER NOT NULL,
+                updated_at INTEGER NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def load(self) -> Dict[str, Tuple[int, int, int]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, client_id, up, down FROM traffic_checkpoint").fetchall()
+        return {name: (client_id, up, down) for name, client_id, up, down in rows}
+
+    def deltas(self, clients: Iterable[Dict]) -> List[Tuple[Dict, int, int]]:
+        """Return (client, up_delta, down_delta) for every client whose counters grew"""
+        seen = self.load()
+        result = []
+        for client in clients:
+            up = client.get('up', 0)
+            down = client.get('down', 0)
+            client_id, last_up, last_down = seen.get(client['name'], (None, 0, 0))
+            if client_id is not None and client_id != client.get('id'):
+                last_up, last_down = 0, 0
+            up_delta = up - last_up if up >= last_up else up
+            down_delta = down - last_down if down >= last_down else down
+            if up_delta > 0 or down_delta > 0:
+                result.append((client, up_delta, down_delta))
+        return result
+
+    def record(self, entries: Iterable[Tuple[str, int, int, int]]) -> None:
+        """Store (name, client_id, up, down) as the new last-seen counters"""
+        now = int(time.time())
+        with self._lock:
+            self._conn.executemany("""
+                INSERT INTO traffic_checkpoint (name, client_id, up, down, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    client_id = excluded.client_id,
+                    up = excluded.up,
+                    down = excluded.down,
+                    updated_at = excluded.updated_at
+            """, [(name, client_id, up, down, now) for name, client_id, up, down in entries])
+            self._conn.commit()
+
+    def retain(self, names: Iterable[str]) -> None:
+        """Drop checkpoints of clients that are gone or whose counters are zero"""
+        with self._lock:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_names (name TEXT PRIMARY KEY)")
+            self._conn.execute("DELETE FROM keep_names")
+            self._conn.executemany("INSERT OR IGNORE INTO keep_names VALUES (?)",
+                                   [(name,) for name in names])
+            self._conn.execute(
+                "DELETE FROM traffic_checkpoint WHERE name NOT IN (SELECT name FROM keep_names)")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,150 @@
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+PENDING = 'pending'
+CHARGED = 'charged'
+RESETTING = 'resetting'
+HELD = 'held'
+DONE = 'done'
+ABORTED = 'aborted'
+
+
+class TrafficJournal:
+    """Write-ahead journal for the charge-then-reset traffic transfer.
+
+    Every transfer is recorded as pending before XMPlus is charged, tagged
+    with the batch id its MySQL transaction also writes to sync_transfer,
+    moved to charged once the commit is confirmed, to resetting just before
+    its s-ui reset is sent and to done as soon as the second phase (s-ui
+    reset or checkpoint update) succeeds. Entries a crash leaves unfinished
+    are resolved on the next pass; a pending batch counts as charged when
+    XMPlus has its sync_transfer row. A reset whose outcome the counters
+    cannot tell is held until an operator resolves it.
+    """
+
+    def __init__(self, path: str, retention_days: int = 7):
+        self.path = path
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS traffic_journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                mode TEXT NOT NULL,
+                name TEXT NOT NULL,
+                client_id INTEGER,
+                up INTEGER NOT NULL,
+                down INTEGER NOT NULL,
+                charged_up INTEGER NOT NULL,
+                charged_down INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                created_at INTEGER NOT NULL,
+                updated_at INTEGER NOT NULL,
+                batch TEXT
+            )
+        """)
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(traffic_journal)")}
+        if 'batch' not in columns:
+            self._conn.execute("ALTER TABLE traffic_journal ADD COLUMN batch TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS traffic_journal_state ON traffic_journal (state)")
+        self._conn.commit()
+
+    def begin(self, mode: str,
+              entries: Iterable[Tuple[str, int, int, int, int, int]]) -> Dict[str, int]:
+        """Record (name, client_id, up, down, charged_up, charged_down) as pending.
+
+        up/down are the s-ui counters observed, charged_up/charged_down the raw
+        bytes about to be charged. Returns the journal entry id per name.
+        """
+        now = int(time.time())
+        ids = {}
+        with self._lock:
+            for name, client_id, up, down, charged_up, charged_down in entries:
+                cursor = self._conn.execute("""
+                    INSERT INTO traffic_journal
+                        (mode, name, client_id, up, down, charged_up, charged_down,
+                         state, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (mode, name, client_id, up, down, charged_up, charged_down, PENDING, now, now))
+                ids[name] = cursor.lastrowid
+            self._conn.commit()
+        return ids
+
+    def assign_batch(self, entry_ids: Iterable[int]) -> str:
+        """Tag entries about to be charged in one transaction with a new batch id and return it"""
+        batch = uuid.uuid4().hex
+        now = int(time.time())
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE traffic_journal SET batch = ?, updated_at = ? WHERE id = ?",
+                [(batch, now, entry_id) for entry_id in entry_ids])
+            self._conn.commit()
+        return batch
+
+    def mark(self, entry_ids: Iterable[int], state: str) -> None:
+        now = int(time.time())
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE traffic_journal SET state = ?, updated_at = ? WHERE id = ?",
+                [(state, now, entry_id) for entry_id in entry_ids])
+            self._conn.commit()
+
+    def entries(self, states: Iterable[str]) -> List[Dict]:
+        states = list(states)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM traffic_journal WHERE state IN ({', '.join(['?'] * len(states))}) ORDER BY id",
+                states).fetchall()
+        return [dict(row) for row in rows]
+
+    def unfinished(self) -> List[Dict]:
+        return self.entries((PENDING, CHARGED, RESETTING, HELD))
+
+    def resolve_held(self, entry_id: int, applied: bool) -> bool:
+        """Settle a held reset: done if it reached s-ui, otherwise charged so the next pass resets it.
+
+        Returns False when no held entry has this id.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE traffic_journal SET state = ?, updated_at = ? WHERE id = ? AND state = ?",
+                (DONE if applied else CHARGED, int(time.time()), entry_id, HELD))
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def purge(self) -> None:
+        """Delete finished entries older than retention_days"""
+        cutoff = int(time.time()) - self.retention_days * 86400
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM traffic_journal WHERE state IN (?, ?) AND updated_at < ?",
+                (DONE, ABORTED, cutoff))
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def reset_was_applied(entry: Dict, client: Dict) -> Optional[bool]:
+    """Whether a journaled s-ui reset reached the panel, judged by the live counters.
+
+    s-ui counters only grow between resets, so counters below the journaled
+    values mean the reset went through and counters still equal to them mean
+    it did not. Counters past the journaled values fit both a lost reset and
+    one followed by enough new usage, so the answer is None. Read right after
+    the reset, before there is new usage to speak of, counters past the
+    values it started from mean it did not go through.
+    """
+    up, down = client.get('up', 0), client.get('down', 0)
+    if up < entry['up'] or down < entry['down']:
+        return True
+    if up == entry['up'] and down == entry['down']:
+        return False
+    return None
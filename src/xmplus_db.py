@@ -0,0 +1,341 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import mysql.connector
+from mysql.connector import pooling
+
+from bulk_save import chunked
+from eligibility import EligibilityRules, checked_column
+
+TRAFFIC_RATIO = 0.8
+INSERT_CHUNK_SIZE = 1000
+STREAM_BATCH_SIZE = 5000
+
+
+class XMPlusPool:
+    """Pool of XMPlus MySQL connections, health-checked before each checkout.
+
+    Configured from the optional database.xmplus.pool section; all other keys
+    of database.xmplus are passed to mysql.connector unchanged. Connections
+    are opened lazily on first use.
+    """
+
+    def __init__(self, db_config: Dict, name: str = 'xmplus'):
+        self.db_config = {k: v for k, v in db_config.items() if k != 'pool'}
+        pool_config = db_config.get('pool') or {}
+        self.name = name
+        self.size = int(pool_config.get('size', 4))
+        self.acquire_timeout = float(pool_config.get('acquire_timeout', 10))
+        self.ping_attempts = int(pool_config.get('ping_attempts', 2))
+        self.ping_delay = float(pool_config.get('ping_delay', 1))
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> pooling.MySQLConnectionPool:
+        with self._lock:
+            if self._pool is None:
+                self._pool = pooling.MySQLConnectionPool(
+                    pool_name=self.name,
+                    pool_size=self.size,
+                    pool_reset_session=True,
+                    **self.db_config
+                )
+            return self._pool
+
+    def _acquire(self) -> pooling.PooledMySQLConnection:
+        pool = self._get_pool()
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            try:
+                conn = pool.get_connection()
+                break
+            except pooling.PoolError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+
+        try:
+            # Reconnects a link the server dropped while the connection sat idle
+            conn.ping(reconnect=True, attempts=self.ping_attempts, delay=self.ping_delay)
+        except mysql.connector.Error:
+            conn.close()
+            raise
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[pooling.PooledMySQLConnection]:
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            # Returns the connection to the pool instead of closing the socket
+            conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                # mysql.connector has no public API for draining a pool
+                self._pool._remove_connections()
+                self._pool = None
+
+
+_shared_pools: Dict[tuple, XMPlusPool] = {}
+_shared_lock = threading.Lock()
+
+
+def get_xmplus_pool(db_config: Dict) -> XMPlusPool:
+    """Return the process-wide pool for this database.xmplus config"""
+    key = (db_config.get('host'), db_config.get('port'),
+           db_config.get('user'), db_config.get('database'))
+    with _shared_lock:
+        pool = _shared_pools.get(key)
+        if pool is None:
+            pool = _shared_pools[key] = XMPlusPool(db_config, name=f"xmplus_{len(_shared_pools)}")
+        return pool
+
+
+_remaining_column: Dict[str, bool] = {}
+
+
+def has_remaining_column(conn) -> bool:
+    """Whether service has the indexed remaining column; checked once per database"""
+    database = conn.database
+    if database not in _remaining_column:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT COUNT(*) FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'service' AND COLUMN_NAME = 'remaining'
+            """)
+            _remaining_column[database] = cursor.fetchone()[0] > 0
+        finally:
+            cursor.close()
+    return _remaining_column[database]
+
+
+def iter_active_uuids(conn, rules: EligibilityRules,
+                      batch_size: int = STREAM_BATCH_SIZE) -> Iterator[str]:
+    """Stream the uuids of services eligible for s-ui without buffering the result set"""
+    query, params = rules.compile(use_remaining_column=has_remaining_column(conn))
+    cursor = conn.cursor(buffered=False)
+    try:
+        cursor.execute(query, params)
+        if rules.shard is None:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for (uuid,) in rows:
+                    yield uuid
+            return
+
+        # Sharding is evaluated here, so max_users is applied to this node's share.
+        # The result set is read to the end, an unbuffered cursor cannot be left half-read.
+        count = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for (uuid,) in rows:
+                if (not rules.max_users or count < rules.max_users) and rules.shard.owns(uuid):
+                    yield uuid
+                    count += 1
+    finally:
+        cursor.close()
+
+
+def fetch_active_uuids(conn, rules: EligibilityRules) -> Set[str]:
+    return set(iter_active_uuids(conn, rules))
+
+
+def fetch_service_columns(conn, columns: List[str],
+                          batch_size: int = STREAM_BATCH_SIZE) -> Dict[str, List]:
+    """Read the given service columns into one list per column, for in-memory rule evaluation"""
+    table: Dict[str, List] = {column: [] for column in columns}
+    lists = [table[column] for column in columns]
+    cursor = conn.cursor(buffered=False)
+    try:
+        cursor.execute("SELECT {} FROM service".format(
+            ', '.join(f"`{checked_column(column)}`" for column in columns)))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                for values, value in zip(lists, row):
+                    values.append(value)
+    finally:
+        cursor.close()
+    return table
+
+
+def select_eligible_in_memory(conn, rules: EligibilityRules) -> Set[str]:
+    """Same result as fetch_active_uuids, with the rules evaluated locally instead of in SQL"""
+    return set(rules.select(fetch_service_columns(conn, rules.columns())))
+
+
+def get_service_cursor(conn, column: str):
+    """Current high-water mark of column in the service table"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT MAX(`{checked_column(column)}`) FROM service")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def fetch_changed_services(conn, column: str, since: Optional[str],
+                           columns: Iterable[str] = ('uuid', 'status', 'traffic', 'total_used')) -> List[Dict]:
+    """Service rows whose column is at or past since.
+
+    Rows at exactly since are read again, so rows updated within the same
+    timestamp tick as the previous high-water mark are not missed.
+    """
+    column = checked_column(column)
+    selected = ', '.join(f"`{checked_column(name)}`" for name in columns)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"""
+            SELECT {selected}, `{column}` AS change_cursor
+            FROM service
+            WHERE `{column}` >= %s
+        """, (since,))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def billable_traffic(up: int, down: int) -> Tuple[int, int]:
+    """Convert raw s-ui counters into the (u, d) values charged in XMPlus"""
+    return int(up / TRAFFIC_RATIO), int(down / TRAFFIC_RATIO)
+
+
+def _apply_with_join(cursor, deltas: Dict[str, Tuple[int, int]]) -> Dict[str, int]:
+    # Copy the uuid column definition so the join never hits a collation mismatch
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS traffic_delta")
+    cursor.execute("""
+        CREATE TEMPORARY TABLE traffic_delta
+        SELECT uuid, u, d FROM service LIMIT 0
+    """)
+    for chunk in chunked(deltas.items(), INSERT_CHUNK_SIZE):
+        cursor.executemany(
+            "INSERT INTO traffic_delta (uuid, u, d) VALUES (%s, %s, %s)",
+            [(token, u, d) for token, (u, d) in chunk]
+        )
+
+    cursor.execute("""
+        SELECT t.uuid, COUNT(s.uuid)
+        FROM traffic_delta t
+        LEFT JOIN service s ON s.uuid = t.uuid
+        GROUP BY t.uuid
+    """)
+    rowcounts = {token: int(count) for token, count in cursor.fetchall()}
+
+    cursor.execute("""
+        UPDATE service s
+        JOIN traffic_delta t ON s.uuid = t.uuid
+        SET s.u = s.u + t.u,
+            s.d = s.d + t.d,
+            s.total_used = s.total_used + t.u + t.d
+    """)
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS traffic_delta")
+    return rowcounts
+
+
+def _apply_row_by_row(cursor, deltas: Dict[str, Tuple[int, int]]) -> Dict[str, int]:
+    rowcounts = {}
+    for token, (u, d) in deltas.items():
+        cursor.execute("""
+            UPDATE service
+            SET u = u + %s,
+                d = d + %s,
+                total_used = total_used + %s
+            WHERE uuid = %s
+        """, (u, d, u + d, token))
+        rowcounts[token] = cursor.rowcount
+    return rowcounts
+
+
+TRANSFER_RETENTION_DAYS = 7
+# Same definition as sql/sync_transfer.sql
+TRANSFER_TABLE = """
+    CREATE TABLE IF NOT EXISTS sync_transfer (
+        batch CHAR(32) NOT NULL PRIMARY KEY,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        KEY idx_sync_transfer_created (created_at)
+    )
+"""
+_transfer_table: Set[str] = set()
+
+
+def ensure_transfer_table(conn) -> None:
+    """Create the sync_transfer ledger if needed and drop old batches; done once per database"""
+    database = conn.database
+    if database in _transfer_table:
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.execute(TRANSFER_TABLE)
+        cursor.execute("DELETE FROM sync_transfer WHERE created_at < NOW() - INTERVAL %s DAY",
+                       (TRANSFER_RETENTION_DAYS,))
+        conn.commit()
+    finally:
+        cursor.close()
+    _transfer_table.add(database)
+
+
+def committed_batches(conn, batches: Iterable[str]) -> Set[str]:
+    """The batch ids whose traffic charge committed"""
+    batches = list(batches)
+    if not batches:
+        return set()
+    cursor = conn.cursor()
+    try:
+        committed = set()
+        for chunk in chunked(batches, INSERT_CHUNK_SIZE):
+            cursor.execute(f"SELECT batch FROM sync_transfer WHERE batch IN ({', '.join(['%s'] * len(chunk))})",
+                           chunk)
+            committed.update(row[0] for row in cursor.fetchall())
+        return committed
+    finally:
+        cursor.close()
+
+
+def apply_traffic_deltas(conn, deltas: Iterable[Tuple[str, int, int]],
+                         batch: Optional[str] = None) -> Dict[str, int]:
+    """Charge (uuid, u, d) deltas to XMPlus in a single transaction.
+
+    Uses one UPDATE ... JOIN against a temporary table and falls back to
+    per-row updates on the same connection when temporary tables are not
+    allowed. A batch id is inserted into sync_transfer in the same
+    transaction, so whether it committed can be checked later. Returns the
+    number of service rows matched per uuid; on error the transaction is
+    rolled back and the exception propagates.
+    """
+    merged: Dict[str, Tuple[int, int]] = {}
+    for token, u, d in deltas:
+        prev_u, prev_d = merged.get(token, (0, 0))
+        merged[token] = (prev_u + u, prev_d + d)
+    if not merged:
+        return {}
+
+    cursor = conn.cursor()
+    try:
+        try:
+            rowcounts = _apply_with_join(cursor, merged)
+        except mysql.connector.Error as e:
+            logging.warning("Bulk traffic update unavailable (%s), using per-row updates", e)
+            conn.rollback()
+            rowcounts = _apply_row_by_row(cursor, merged)
+        if batch is not None:
+            cursor.execute("INSERT INTO sync_transfer (batch) VALUES (%s)", (batch,))
+        conn.commit()
+        return rowcounts
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
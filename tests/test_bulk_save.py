@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from bulk_save import save_in_batches  # noqa: E402
+
+
+class SaveInBatchesTest(unittest.TestCase):
+
+    def save(self, batch_result):
+        singles = []
+
+        def save_one(item):
+            singles.append(item)
+            return True
+
+        saved = save_in_batches(range(5), 2, lambda chunk: batch_result, save_one)
+        return saved, singles
+
+    def test_saved_chunks_are_not_sent_again(self):
+        saved, singles = self.save(True)
+        # The last chunk has one item and is always saved on its own
+        self.assertEqual(saved, [0, 1, 2, 3, 4])
+        self.assertEqual(singles, [4])
+
+    def test_rejected_chunks_fall_back_to_single_saves(self):
+        saved, singles = self.save(False)
+        self.assertEqual(saved, [0, 1, 2, 3, 4])
+        self.assertEqual(singles, [0, 1, 2, 3, 4])
+
+    def test_chunks_with_unknown_outcome_are_left_for_the_next_pass(self):
+        saved, singles = self.save(None)
+        self.assertEqual(saved, [4])
+        self.assertEqual(singles, [4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,314 @@
+"""Recovery of half-done traffic transfers from the journal.
+
+SyncService runs against an in-memory s-ui panel and XMPlus ledger, replacing
+only the methods that talk to them, so journal states and recovery are the
+real code paths.
+
+    python -m unittest discover tests
+"""
+import contextlib
+import functools
+import json
+import os
+import sys
+import tempfile
+import unittest
+from typing import Dict, List, Optional, Set, Tuple
+
+import mysql.connector
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from metrics import JOURNAL_HELD  # noqa: E402
+from sync_service import SyncService  # noqa: E402
+from traffic_journal import ABORTED, CHARGED, DONE, HELD, PENDING, RESETTING  # noqa: E402
+
+
+class FakeService(SyncService):
+    """SyncService with s-ui and the XMPlus charge kept in memory"""
+
+    def __init__(self, state_path: str, traffic_mode: str = 'reset'):
+        super().__init__({
+            'database': {'xmplus': {}},
+            'api_token': 'token',
+            'obfs_password': 'obfs',
+            'server_ip': '127.0.0.1',
+            'sync': {'state_path': state_path, 'traffic_mode': traffic_mode, 'reset_threshold': 1000},
+        })
+        self.clients: Dict[str, Dict] = {}
+        # uuid -> (up, down) charged to XMPlus
+        self.charged: Dict[str, Tuple[int, int]] = {}
+        self.ledger: Set[str] = set()
+        self.ledger_down = False
+        # Edits that time out, before or after s-ui applies them
+        self.lose_edit_reply: Set[str] = set()
+        self.drop_edit: Set[str] = set()
+        self.read_back_fails = False
+        self.edits: List[Dict] = []
+
+    def _setup_logging(self) -> None:
+        pass
+
+    def add_client(self, name: str, up: int, down: int) -> Dict:
+        client = {'id': len(self.clients) + 1, 'name': name, 'enable': True, 'config': {}, 'up': up, 'down': down}
+        self.clients[name] = client
+        return client
+
+    def use(self, name: str, up: int, down: int) -> None:
+        self.clients[name]['up'] += up
+        self.clients[name]['down'] += down
+
+    def _fetch_clients(self) -> Optional[List[Dict]]:
+        return [dict(client) for client in self.clients.values()]
+
+    def _fetch_client(self, client_id: int) -> Optional[Dict]:
+        if self.read_back_fails:
+            raise requests.exceptions.ConnectionError("s-ui unreachable")
+        for client in self.clients.values():
+            if client['id'] == client_id:
+                return dict(client)
+        return None
+
+    def _post_save(self, action: str, data: str) -> Dict:
+        assert action == 'edit'
+        record = json.loads(data)
+        self.edits.append(record)
+        if record['name'] in self.drop_edit:
+            raise requests.exceptions.ReadTimeout("no reply")
+        self.clients[record['name']].update(up=record['up'], down=record['down'])
+        if record['name'] in self.lose_edit_reply:
+            raise requests.exceptions.ReadTimeout("no reply")
+        return {'success': True}
+
+    def _update_xmplus_traffic_bulk(self, usage, batch):
+        for token, up, down in usage:
+            prev_up, prev_down = self.charged.get(token, (0, 0))
+            self.charged[token] = (prev_up + up, prev_down + down)
+        self.ledger.add(batch)
+        return {token: 1 for token, _, _ in usage}
+
+    def _committed_batches(self, batches):
+        if self.ledger_down:
+            raise mysql.connector.Error("server has gone away")
+        return set(batches) & self.ledger
+
+
+class NoCreateConnection:
+    """XMPlus connection of a MySQL user without CREATE privilege"""
+    database = 'no_create'
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        raise mysql.connector.errors.ProgrammingError("CREATE command denied")
+
+    def close(self):
+        pass
+
+
+class RecoveryTest(unittest.TestCase):
+    traffic_mode = 'reset'
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.service = FakeService(os.path.join(self.tmp.name, 'state.db'), self.traffic_mode)
+        self.journal = self.service._get_journal()
+
+    def tearDown(self):
+        self.service.close()
+        self.tmp.cleanup()
+
+    def journal_entry(self, state: str, name: str, up: int, down: int, batch: Optional[str] = None) -> int:
+        client = self.service.clients[name]
+        entry_id = self.journal.begin(self.traffic_mode, [(name, client['id'], up, down, up, down)])[name]
+        if batch is not None:
+            self.journal._conn.execute("UPDATE traffic_journal SET batch = ? WHERE id = ?", (batch, entry_id))
+            self.journal._conn.commit()
+        self.journal.mark([entry_id], state)
+        return entry_id
+
+    def state(self, entry_id: int) -> str:
+        return self.journal._conn.execute(
+            "SELECT state FROM traffic_journal WHERE id = ?", (entry_id,)).fetchone()[0]
+
+
+class ResetRecoveryTest(RecoveryTest):
+
+    def test_pending_charge_in_ledger_is_not_charged_again(self):
+        self.service.add_client('a', 1000, 2000)
+        entry_id = self.journal_entry(PENDING, 'a', 1000, 2000, batch='b1')
+        self.service.charged['a'] = (1000, 2000)
+        self.service.ledger.add('b1')
+        self.service.use('a', 10, 20)
+
+        self.service.sync_traffic()
+
+        self.assertEqual(self.state(entry_id), DONE)
+        # Only the usage since the crash is charged on top
+        self.assertEqual(self.service.charged['a'], (1010, 2020))
+        self.assertEqual((self.service.clients['a']['up'], self.service.clients['a']['down']), (0, 0))
+
+    def test_pending_charge_missing_from_ledger_is_charged(self):
+        self.service.add_client('a', 1000, 2000)
+        entry_id = self.journal_entry(PENDING, 'a', 1000, 2000, batch='b1')
+
+        self.service.sync_traffic()
+
+        self.assertEqual(self.state(entry_id), ABORTED)
+        self.assertEqual(self.service.charged['a'], (1000, 2000))
+
+    def test_pending_charge_waits_while_ledger_cannot_be_read(self):
+        self.service.add_client('a', 1000, 2000)
+        entry_id = self.journal_entry(PENDING, 'a', 1000, 2000, batch='b1')
+        self.service.ledger_down = True
+
+        self.service.sync_traffic()
+
+        self.assertEqual(self.state(entry_id), PENDING)
+        self.assertNotIn('a', self.service.charged)
+
+    def test_charged_entry_takes_only_charged_bytes_off(self):
+        self.service.add_client('a', 1000, 2000)
+        entry_id = self.journal_entry(CHARGED, 'a', 1000, 2000)
+        self.service.charged['a'] = (1000, 2000)
+        self.service.use('a', 10, 20)
+
+        self.service.sync_traffic()
+
+        self.assertEqual(self.state(entry_id), DONE)
+        self.assertEqual(self.service.charged['a'], (1010, 2020))
+
+    def test_resetting_entry_below_journal_went_through(self):
+        self.service.add_client('a', 10, 20)
+        entry_id = self.journal_entry(RESETTING, 'a', 1000, 2000)
+        self.service.charged['a'] = (1000, 2000)
+
+        self.service.sync_traffic()
+
+        self.assertEqual(self.state(entry_id), DONE)
+        self.assertEqual(self.service.charged['a'], (1010, 2020))
+
+    def test_resetting_entry_at_journal_is_reset(self):
+        self.service.add_client('a', 1000, 2000)
+        entry_id = self.journal_entry(RESETTING, 'a', 1000, 2000)
+        self.service.charged['a'] = (1000, 2000)
+
+        self.service.sync_traffic()
+
+        self.assertEqual(self.state(entry_id), DONE)
+        self.assertEqual(self.service.charged['a'], (1000, 2000))
+        self.assertEqual((self.service.clients['a']['up'], self.service.clients['a']['down']), (0, 0))
+
+    def test_undecidable_resetting_entry_is_held_until_resolved(self):
+        self.service.add_client('a', 1500, 2500)
+        entry_id = self.journal_entry(RESETTING, 'a', 1000, 2000)
+        self.service.charged['a'] = (1000, 2000)
+
+        self.service.sync_traffic()
+        self.service.sync_traffic()
+
+        self.assertEqual(self.state(entry_id), HELD)
+        self.assertEqual(self.service.charged['a'], (1000, 2000))
+        self.assertEqual(JOURNAL_HELD.samples(), ['xmplus_sync_journal_held_entries 1'])
+        self.assertEqual([entry['id'] for entry in self.service.held_transfers()], [entry_id])
+
+        # The operator found the reset was lost: the counters still hold the charged bytes
+        self.service.resolve_held_transfer(entry_id, applied=False)
+        self.service.sync_traffic()
+
+        self.assertEqual(self.state(entry_id), DONE)
+        self.assertEqual(self.service.charged['a'], (1500, 2500))
+        self.assertEqual(JOURNAL_HELD.samples(), ['xmplus_sync_journal_held_entries 0'])
+        with self.assertRaises(ValueError):
+            self.service.resolve_held_transfer(entry_id, applied=True)
+
+    def test_lost_reply_of_applied_reset_is_read_back(self):
+        self.service.add_client('a', 1000, 2000)
+        self.service.lose_edit_reply.add('a')
+
+        self.assertEqual(self.service.sync_traffic(), 1)
+
+        self.assertEqual(self.journal.unfinished(), [])
+        self.service.lose_edit_reply.clear()
+        self.service.use('a', 10, 20)
+        self.service.sync_traffic()
+        self.assertEqual(self.service.charged['a'], (1010, 2020))
+
+    def test_lost_reset_is_read_back_and_redone(self):
+        self.service.add_client('a', 1000, 2000)
+        self.service.drop_edit.add('a')
+
+        self.assertEqual(self.service.sync_traffic(), 0)
+
+        [entry] = self.journal.unfinished()
+        self.assertEqual(entry['state'], CHARGED)
+        self.service.drop_edit.clear()
+        self.service.use('a', 10, 20)
+        self.service.sync_traffic()
+        self.assertEqual(self.state(entry['id']), DONE)
+        self.assertEqual(self.service.charged['a'], (1010, 2020))
+
+    def test_reset_that_cannot_be_read_back_stays_resetting(self):
+        self.service.add_client('a', 1000, 2000)
+        self.service.drop_edit.add('a')
+        self.service.read_back_fails = True
+
+        self.service.sync_traffic()
+
+        [entry] = self.journal.unfinished()
+        self.assertEqual(entry['state'], RESETTING)
+
+    def test_reset_sends_the_whole_stored_record_back(self):
+        self.service.add_client('a', 1000, 2000)['tls_fingerprint'] = 'chrome'
+
+        self.service.sync_traffic()
+
+        [record] = self.service.edits
+        self.assertEqual(record['tls_fingerprint'], 'chrome')
+        self.assertEqual((record['up'], record['down']), (0, 0))
+
+    def test_missing_ledger_fails_the_pass_without_charging(self):
+        self.service.add_client('a', 1000, 2000)
+        # The real charge, on a connection that cannot create sync_transfer
+        self.service._update_xmplus_traffic_bulk = functools.partial(
+            SyncService._update_xmplus_traffic_bulk, self.service)
+        self.service._connect_xmplus = lambda: contextlib.nullcontext(NoCreateConnection())
+
+        with self.assertRaises(RuntimeError):
+            self.service.sync_traffic()
+
+        self.assertEqual(self.journal.unfinished(), [])
+        self.assertEqual((self.service.clients['a']['up'], self.service.clients['a']['down']), (1000, 2000))
+
+
+class DeltaRecoveryTest(RecoveryTest):
+    traffic_mode = 'delta'
+
+    def test_charged_entry_moves_checkpoint(self):
+        self.service.add_client('a', 100, 200)
+        entry_id = self.journal_entry(CHARGED, 'a', 100, 200)
+        self.service.charged['a'] = (100, 200)
+        self.service.use('a', 10, 20)
+
+        self.service.sync_traffic()
+
+        self.assertEqual(self.state(entry_id), DONE)
+        self.assertEqual(self.service.charged['a'], (110, 220))
+
+    def test_pending_charge_in_ledger_moves_checkpoint(self):
+        self.service.add_client('a', 100, 200)
+        entry_id = self.journal_entry(PENDING, 'a', 100, 200, batch='b1')
+        self.service.charged['a'] = (100, 200)
+        self.service.ledger.add('b1')
+
+        self.service.sync_traffic()
+
+        self.assertEqual(self.state(entry_id), DONE)
+        self.assertEqual(self.service.charged['a'], (100, 200))
+
+
+if __name__ == '__main__':
+    unittest.main()